@@ -0,0 +1,70 @@
+"""Requests per second of the signature rewrite, a policy and the Security dependency.
+
+    python benchmarks/bench_dependency.py [requests]
+"""
+import sys
+import time
+
+from fastapi import FastAPI
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+
+import lollol
+
+
+def _report(name, count, elapsed):
+    print("%-28s %10.0f requests/sec" % (name, count / elapsed))
+
+
+def _rewrite_app():
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    @lollol.authorize_required
+    async def get_user(user_id: str, scopes=SecurityScopes(["user:read"])):
+        return {"id": user_id}
+
+    return app
+
+
+def _policy_app():
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    @lollol.authorize_required(policy="'user:read' in scopes and claim.sub == path.user_id")
+    async def get_user(user_id: str):
+        return {"id": user_id}
+
+    return app
+
+
+def _security_app():
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: str, token=lollol.authorize_scopes(["user:read"])):
+        return {"id": user_id}
+
+    return app
+
+
+def main(count=3000):
+    manager = lollol.LoginManager("bench_secret", "/auth")
+    lollol.PermissionManager(manager)
+    token = manager.create_access_token(data=dict(sub="1", scopes=["user:read"]))
+    headers = {"Authorization": "Bearer %s" % token}
+
+    for name, app in (("authorize_required", _rewrite_app()),
+                      ("authorize_required(policy)", _policy_app()),
+                      ("authorize_scopes", _security_app())):
+        client = TestClient(app)
+        assert client.get("/users/1", headers=headers).status_code == 200
+
+        start = time.perf_counter()
+        for _ in range(count):
+            client.get("/users/1", headers=headers)
+        _report(name, count, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,31 @@
+"""Tokens per second of single and bulk token issuance.
+
+    python benchmarks/bench_issue.py [count]
+"""
+import sys
+import time
+
+import lollol
+
+
+def _report(name, count, elapsed):
+    print("%-28s %10.0f tokens/sec" % (name, count / elapsed))
+
+
+def main(count=20000):
+    manager = lollol.LoginManager("bench_secret", "/auth")
+    claims = [dict(sub="service%d" % i, scopes=["user:read"]) for i in range(count)]
+
+    start = time.perf_counter()
+    for data in claims:
+        manager.create_access_token(data=data)
+    _report("create_access_token", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in manager.create_access_tokens(claims):
+        pass
+    _report("create_access_tokens", count, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,79 @@
+"""Resident bytes per route protected by authorize_router.
+
+The reference routes are wrapped the way authorize_router wrapped them
+before the checkers were shared: a scopes parameter built per route, left
+unannotated so FastAPI declares it as a query field, and a wrapper closing
+over the route state in six cells.
+
+    python benchmarks/bench_route_memory.py [routes]
+"""
+import functools
+import inspect
+import sys
+import tracemalloc
+
+from fastapi import APIRouter, Request
+from fastapi.security import SecurityScopes
+
+import lollol
+from lollol._utils import _authorize_request, _get_code_from_function
+
+
+def _reference_wrapper(endpoint):
+    sig = inspect.signature(endpoint)
+    request = inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Request)
+    scope = inspect.Parameter("scopes", inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                              default=SecurityScopes(["user:read"]))
+    parameters = [request, *sig.parameters.values(), scope]
+    endpoint.__signature__ = inspect.Signature(parameters)
+    endpoint.__code__ = _get_code_from_function(endpoint, len(parameters), request=request, scope=scope)
+
+    request_var_name, keep_request, is_coroutine, cache = "request", True, True, None
+    scopes = scope.default
+
+    @functools.wraps(endpoint)
+    async def decorator(*args, **kwargs):
+        request_obj = kwargs[request_var_name] if keep_request else kwargs.pop(request_var_name)
+        await _authorize_request(request_obj, scopes)
+        if cache is None and is_coroutine:
+            return await endpoint(*args, **kwargs)
+    return decorator
+
+
+def _add_routes(router, count, wrap=None):
+    for i in range(count):
+        # a new function per route, like the endpoints of a large application.
+        namespace = {}
+        exec("async def endpoint_%d(item_id: int):\n    return item_id" % i, namespace)
+        endpoint = namespace["endpoint_%d" % i]
+        if wrap is not None:
+            endpoint = wrap(endpoint)
+        router.get("/items%d/{item_id}" % i)(endpoint)
+
+
+def _bytes_per_route(count, protect=False, wrap=None):
+    router = APIRouter()
+    if protect:
+        lollol.authorize_router(router, SecurityScopes(["user:read"]))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    _add_routes(router, count, wrap)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def main(count=2000):
+    plain = _bytes_per_route(count)
+    reference = _bytes_per_route(count, wrap=_reference_wrapper)
+    protected = _bytes_per_route(count, protect=True)
+    print("%-28s %10.0f bytes/route" % ("plain route", plain))
+    print("%-28s %10.0f bytes/route" % ("reference route", reference))
+    print("%-28s %10.0f bytes/route" % ("protected route", protected))
+    print("%-28s %10.0f bytes/route" % ("authorization overhead", protected - plain))
+    print("%-28s %10.0f bytes/route" % ("saved against reference", reference - protected))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
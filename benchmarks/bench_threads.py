@@ -0,0 +1,59 @@
+"""Verifications per second of PermissionManager by number of threads.
+
+    python benchmarks/bench_threads.py [count] [max threads]
+
+Threads share one manager, its token cache and the session store. With the
+GIL the cached lookups do not scale past one core, on free-threaded Python
+they should scale with the stripes of the caches.
+"""
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.security import SecurityScopes
+
+import lollol
+
+
+def _report(name, threads, count, elapsed):
+    print("%-20s %3d threads %12.0f tokens/sec" % (name, threads, count / elapsed))
+
+
+def _run(verify, tokens, threads, count):
+    per_thread = count // threads
+
+    def work(n):
+        for i in range(per_thread):
+            verify(tokens[(n + i) % len(tokens)])
+
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        list(executor.map(work, range(threads)))
+        return per_thread * threads, time.perf_counter() - start
+
+
+def main(count=200000, max_threads=8):
+    scopes = SecurityScopes(["user:read"])
+    manager = lollol.LoginManager("bench_secret", "/auth", session_store=lollol.SessionStore())
+    permission = lollol.PermissionManager(
+        manager, verifier=lollol.HMACVerifier(), token_cache=lollol.TokenCache()
+    )
+    cases = {
+        "token cache": [
+            manager.create_access_token(data=dict(sub="user%d" % n, scopes=["user:read"]))
+            for n in range(1000)
+        ],
+        "session": [manager.create_session_token("user%d" % n, ["user:read"]) for n in range(1000)],
+    }
+
+    for name, tokens in cases.items():
+        threads = 1
+        while threads <= max_threads:
+            done, elapsed = _run(lambda token: permission.verify(token, scopes), tokens, threads, count)
+            _report(name, threads, done, elapsed)
+            threads *= 2
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,47 @@
+"""Verifications per second of jwt.decode, HMACVerifier and session tokens.
+
+    python benchmarks/bench_verify.py [count]
+"""
+import sys
+import time
+
+import jwt
+
+from fastapi.security import SecurityScopes
+
+import lollol
+
+
+def _report(name, count, elapsed):
+    print("%-28s %10.0f tokens/sec" % (name, count / elapsed))
+
+
+def main(count=50000):
+    manager = lollol.LoginManager("bench_secret", "/auth")
+    token = manager.create_access_token(data=dict(sub="sunny", scopes=["user:read"]))
+    secret = str(manager.secret)
+    verifier = lollol.HMACVerifier()
+
+    start = time.perf_counter()
+    for _ in range(count):
+        jwt.decode(token, secret, algorithms=["HS256"])
+    _report("jwt.decode", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        verifier.decode(token, secret, ["HS256"])
+    _report("HMACVerifier.decode", count, time.perf_counter() - start)
+
+    manager.session_store = lollol.SessionStore()
+    permission = lollol.PermissionManager(manager)
+    session_token = manager.create_session_token("sunny", ["user:read"])
+    scopes = SecurityScopes(["user:read"])
+
+    start = time.perf_counter()
+    for _ in range(count):
+        permission.verify(session_token, scopes)
+    _report("session token verify", count, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,353 @@
+"""Local load test of an application protected by lollol.
+
+A corpus of tokens is created with `LoginManager.create_access_token`,
+the application is served by uvicorn on localhost and asyncio clients send
+requests at a fixed concurrency. Throughput and latency percentiles are
+written as JSON, so runs before and after a change can be compared.
+
+    python benchmarks/loadtest.py run --duration 10 --concurrency 32 -o after.json
+    python benchmarks/loadtest.py compare before.json after.json
+
+The default application protects one GET route with authorize_router.
+Another application can be tested with --app module:attribute, it must
+register a PermissionManager with the secret given by --secret.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from datetime import timedelta
+
+import lollol
+
+
+REQUIRED_SCOPE = "load:read"
+
+# token kind: weight
+DEFAULT_MIX = {
+    "valid": 70,
+    "expired": 10,
+    "wrong_secret": 5,
+    "extra_key": 10,
+    "scope_mismatch": 5,
+}
+EXPECTED_STATUS = {
+    "valid": 200,
+    "expired": 401,
+    "wrong_secret": 401,
+    "extra_key": 200,
+    "scope_mismatch": 401,
+}
+EXTRA_SECRET_KEY = "load-extra"
+
+
+def build_corpus(secret, size, mix=None, scope_sizes=(1, 8, 32), seed=0):
+    """
+    Function to create tokens of the kinds of mix for load test.
+    :return:
+        A list of (kind, headers).
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    managers = {
+        "valid": lollol.LoginManager(secret, "/auth"),
+        "wrong_secret": lollol.LoginManager(secret + "-wrong", "/auth"),
+        "extra_key": lollol.LoginManager(secret + EXTRA_SECRET_KEY, "/auth"),
+    }
+
+    corpus = []
+    for i in range(size):
+        kind = rng.choices(kinds, weights)[0]
+        scope_size = rng.choice(scope_sizes)
+        scopes = ["filler:%d" % n for n in range(scope_size - 1)]
+        if kind != "scope_mismatch":
+            scopes.append(REQUIRED_SCOPE)
+
+        manager = managers.get(kind, managers["valid"])
+        expires = timedelta(seconds=-60) if kind == "expired" else timedelta(hours=1)
+        token = manager.create_access_token(
+            data=dict(sub="load%d" % i, scopes=scopes), expires=expires
+        )
+        headers = {"authorization": "Bearer %s" % token}
+        if kind == "extra_key":
+            headers["x-extra-secret-key"] = EXTRA_SECRET_KEY
+        corpus.append((kind, headers))
+    return corpus
+
+
+def default_app(secret):
+    from fastapi import APIRouter, FastAPI
+    from fastapi.security import SecurityScopes
+
+    lollol.PermissionManager(lollol.LoginManager(secret, "/auth"))
+    router = lollol.authorize_router(APIRouter(), SecurityScopes([REQUIRED_SCOPE]))
+
+    @router.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+def load_app(path):
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "app")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(app, port):
+    """
+    Function to run uvicorn in a thread.
+    :return:
+        The uvicorn server, stop it with `should_exit`.
+    """
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                            access_log=False, lifespan="off")
+    server = uvicorn.Server(config)
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.01)
+    server.thread = thread
+    return server
+
+
+async def _read_chunked(reader):
+    while True:
+        size = int((await reader.readline()).split(b";")[0], 16)
+        if size == 0:
+            break
+        # the chunk and its CRLF
+        await reader.readexactly(size + 2)
+    # trailers end with an empty line
+    while await reader.readline() not in (b"\r\n", b""):
+        pass
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"transfer-encoding":
+            chunked = b"chunked" in value.lower()
+
+    if chunked:
+        await _read_chunked(reader)
+    elif length is not None:
+        await reader.readexactly(length)
+    elif status not in (204, 304) and not 100 <= status < 200:
+        # the body ends when the connection is closed, the next responses
+        # of the connection would be misread.
+        raise ValueError("response without content-length on a keep-alive connection")
+    return status
+
+
+async def _client(port, path, corpus, offset, deadline, results):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            kind, headers = corpus[i % len(corpus)]
+            i += 1
+            lines = ["GET %s HTTP/1.1" % path, "host: 127.0.0.1"]
+            lines.extend("%s: %s" % item for item in headers.items())
+            start = time.perf_counter()
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+            await writer.drain()
+            status = await _read_response(reader)
+            results.append((kind, status, time.perf_counter() - start))
+    finally:
+        writer.close()
+
+
+async def drive(port, path, corpus, concurrency, duration):
+    results = []
+    deadline = time.perf_counter() + duration
+    step = max(1, len(corpus) // concurrency)
+    await asyncio.gather(*(
+        _client(port, path, corpus, n * step, deadline, results)
+        for n in range(concurrency)
+    ))
+    return results
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _latency(values):
+    return {
+        "count": len(values),
+        "p50_ms": _ms(percentile(values, 50)),
+        "p90_ms": _ms(percentile(values, 90)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(max(values) if values else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def summarize(results, duration):
+    by_kind = {}
+    for kind, status, latency in results:
+        by_kind.setdefault(kind, []).append((status, latency))
+
+    kinds = {}
+    for kind, values in sorted(by_kind.items()):
+        summary = _latency([latency for _, latency in values])
+        summary["unexpected_status"] = sum(
+            status != EXPECTED_STATUS.get(kind, status) for status, _ in values
+        )
+        kinds[kind] = summary
+
+    total = _latency([latency for _, _, latency in results])
+    total["requests_per_sec"] = round(len(results) / duration, 1)
+    return {"total": total, "kinds": kinds}
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text):
+    """
+    Function to parse a mix like "valid=70,expired=30".
+    """
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in EXPECTED_STATUS:
+            raise argparse.ArgumentTypeError("unknown token kind %r" % kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+def run(args):
+    corpus = build_corpus(args.secret, args.corpus_size, args.mix,
+                          scope_sizes=args.scope_sizes, seed=args.seed)
+    app = load_app(args.app) if args.app else default_app(args.secret)
+    port = args.port or _free_port()
+    server = serve(app, port)
+    try:
+        # warm up the application before measuring.
+        asyncio.run(drive(port, args.path, corpus, args.concurrency, 1))
+        results = asyncio.run(
+            drive(port, args.path, corpus, args.concurrency, args.duration)
+        )
+    finally:
+        server.should_exit = True
+        server.thread.join()
+
+    report = {
+        "config": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "corpus_size": args.corpus_size,
+            "scope_sizes": args.scope_sizes,
+            "mix": args.mix,
+            "seed": args.seed,
+            "path": args.path,
+            "app": args.app or "default",
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "lollol": lollol.__version__,
+            "revision": _revision(),
+        },
+        "results": summarize(results, args.duration),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)["results"]["total"]
+    with open(args.after) as f:
+        after = json.load(f)["results"]["total"]
+
+    for key in ("requests_per_sec", "p50_ms", "p90_ms", "p99_ms", "max_ms"):
+        old, new = before[key], after[key]
+        change = "" if not old else "%+.1f%%" % ((new - old) / old * 100)
+        print("%-18s %12s %12s %10s" % (key, old, new, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run a load test")
+    run_parser.add_argument("--app", help="module:attribute of the application")
+    run_parser.add_argument("--path", default="/items/1")
+    run_parser.add_argument("--secret", default="load_secret")
+    run_parser.add_argument("--port", type=int)
+    run_parser.add_argument("--duration", type=float, default=10)
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--corpus-size", type=int, default=2000)
+    run_parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                            help="token kinds and weights, e.g. valid=70,expired=30")
+    run_parser.add_argument("--scope-sizes", type=int, nargs="+", default=[1, 8, 32])
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("-o", "--output", help="path of the JSON report")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
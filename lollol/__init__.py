@@ -2,9 +2,72 @@
 
 __version__ = "0.0.1"
 
-from ._authorize import PermissionManager
-from ._authorize import LoginManager
-from ._authorize import lookup_permission_obj
-from ._utils import authorize_required
-from ._utils import authorize_router
-from ._utils import authorize_app
+# Attributes are imported on first access, so token issuance and
+# verification do not import the web framework.
+_LAZY_ATTRS = {
+    "PermissionManager": "._authorize",
+    "LoginManager": "._authorize",
+    "lookup_permission_obj": "._authorize",
+    "get_verified_token": "._authorize",
+    "VerifiedToken": "._authorize",
+    "UserCache": "._cache",
+    "TokenCache": "._cache",
+    "ResponseCache": "._cache",
+    "SessionStore": "._session",
+    "AuditLog": "._audit",
+    "HMACVerifier": "._jwt",
+    "TokenSigner": "._jwt",
+    "IntrospectionVerifier": "._introspection",
+    "CircuitBreaker": "._introspection",
+    "Policy": "._policy",
+    "compile_policy": "._policy",
+    "authorize_required": "._utils",
+    "authorize_router": "._utils",
+    "authorize_app": "._utils",
+    "authorize_scopes": "._utils",
+    "set_threadpool_size": "._utils",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+# type checkers see the attributes, typing is not imported at runtime.
+TYPE_CHECKING = False
+if TYPE_CHECKING:                                                 # pragma: no cover
+    from ._authorize import (                                     # noqa: F401
+        PermissionManager,
+        LoginManager,
+        lookup_permission_obj,
+        get_verified_token,
+        VerifiedToken,
+    )
+    from ._cache import UserCache, TokenCache, ResponseCache      # noqa: F401
+    from ._session import SessionStore                            # noqa: F401
+    from ._audit import AuditLog                                  # noqa: F401
+    from ._jwt import HMACVerifier, TokenSigner                   # noqa: F401
+    from ._introspection import IntrospectionVerifier, CircuitBreaker   # noqa: F401
+    from ._policy import Policy, compile_policy                   # noqa: F401
+    from ._utils import (                                         # noqa: F401
+        authorize_required,
+        authorize_router,
+        authorize_app,
+        authorize_scopes,
+        set_threadpool_size,
+    )
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        ) from None
+
+    # __import__ rather than importlib, so -X importtime reports the module.
+    value = getattr(__import__(module_name[1:], globals(), None, (name,), 1), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
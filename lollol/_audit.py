@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import time
+import typing as t
+
+
+DROP = "drop"
+BLOCK = "block"
+
+# (time, allowed, method, path, client, subject, required scopes)
+AuditRecord = t.Tuple[float, bool, str, str, t.Optional[str], t.Optional[str], t.Sequence[str]]
+
+
+class AuditLog:
+
+    """
+    Audit log of the authorization decisions of `PermissionManager`.
+
+    Decisions are put in a bounded in-memory queue as compact tuples, and a
+    background task writes them in batches as JSON lines to a file which is
+    rotated when it grows over max_bytes. When the queue is full, the "drop"
+    policy drops the record and counts it, the "block" policy makes the
+    request wait until there is room. Batches which cannot be written are
+    counted as failed, and the next batches are written as usual.
+    """
+
+    def __init__(self,
+                 path: str,
+                 *,
+                 maxsize: int = 10000,
+                 batch_size: int = 500,
+                 policy: str = DROP,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 backup_count: int = 5):
+        if policy not in (DROP, BLOCK):
+            raise ValueError("policy must be %r or %r." % (DROP, BLOCK))
+        self.path = path
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._queue: t.Optional[asyncio.Queue] = None
+        self._task: t.Optional[asyncio.Future] = None
+
+    async def record(self,
+                     allowed: bool,
+                     request: t.Any,
+                     subject: t.Optional[str],
+                     required_scopes: t.Sequence[str]) -> None:
+        """
+        Method to log a decision without waiting for the file.
+        :param allowed:
+            True if the request was authorized.
+            type: bool
+        :param request:
+            FastApi request object.
+            type: object
+        :param subject:
+            A subject of the token if it was decoded.
+            type: str
+        :param required_scopes:
+            A scopes required by the endpoint.
+            type: list
+        """
+        if self._task is None:
+            self._start()
+
+        client = request.client
+        # subjects of session tokens may be any object, like a uuid.
+        if subject is not None and not isinstance(subject, str):
+            subject = str(subject)
+        record: AuditRecord = (
+            time.time(), allowed, request.method, request.url.path,
+            client.host if client else None, subject, required_scopes
+        )
+        if self.policy == BLOCK:
+            await self._queue.put(record)                          # type: ignore
+            return
+        try:
+            self._queue.put_nowait(record)                         # type: ignore
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        self._queue = asyncio.Queue(self.maxsize)
+        self._task = asyncio.ensure_future(self._drain())
+
+    async def _drain(self) -> None:
+        queue = self._queue
+        loop = asyncio.get_event_loop()
+        closing = False
+        while not closing:
+            batch = []
+            record = await queue.get()                             # type: ignore
+            while True:
+                # None is put by aclose after the last record.
+                if record is None:
+                    closing = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size or queue.empty():       # type: ignore
+                    break
+                record = queue.get_nowait()                        # type: ignore
+            if batch:
+                try:
+                    await loop.run_in_executor(None, self._write, batch)
+                except Exception:
+                    # the queue is drained anyway, blocked requests must not wait forever.
+                    self.failed += len(batch)
+
+    def _write(self, batch: t.List[AuditRecord]) -> None:
+        data = "".join(
+            json.dumps({
+                "time": record[0],
+                "allowed": record[1],
+                "method": record[2],
+                "path": record[3],
+                "client": record[4],
+                "sub": record[5],
+                "scopes": list(record[6]),
+            }, separators=(",", ":")) + "\n"
+            for record in batch
+        ).encode()
+
+        if self._size() + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.written += len(batch)
+
+    def _size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _rotate(self) -> None:
+        if self.backup_count <= 0:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        for n in range(self.backup_count - 1, 0, -1):
+            source = "%s.%d" % (self.path, n)
+            if os.path.exists(source):
+                os.replace(source, "%s.%d" % (self.path, n + 1))
+        if os.path.exists(self.path):
+            os.replace(self.path, self.path + ".1")
+
+    async def aclose(self) -> None:
+        """
+        Method to write the queued decisions and stop the background task.
+        """
+        if self._task is None:
+            return
+
+        task, self._task = self._task, None
+        await self._queue.put(None)                                # type: ignore
+        await task
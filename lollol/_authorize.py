@@ -1,40 +1,73 @@
 import typing as t
+import asyncio
 import functools
+import hashlib
+import hmac
+import inspect
+import threading
 import types
 import jwt
 
-from datetime import timedelta
+from calendar import timegm
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta
 from fastapi import Request
 from fastapi_login import LoginManager as _LoginManager
 from fastapi.security import SecurityScopes
 from starlette.datastructures import Secret
 
+from ._cache import UserCache
+from ._cache import TokenCache
+from ._cache import SingleFlight
+from ._jwt import TokenSigner
+from ._jwt import HMACVerifier
+from ._introspection import IntrospectionVerifier
+from ._audit import AuditLog
+from ._session import Session
+from ._session import SessionStore
+from ._jwt import _init_signer_worker
+from ._jwt import _sign_in_worker
+from ._pool import chunked
+from ._pool import imap_bounded
+from ._claims import ClaimPath
+from ._claims import ScopeMap
+from ._claims import compile_scope_extractor
+
 
 StrInt = t.Union[str, int]
 
+_VERIFIED_TOKEN_ATTR = "verified_token"
+
 
 class _PermissionLocal:
 
+    # requests read the tuple without lock, registrations replace it.
     def __init__(self):
-        self._local = []
+        self._local: t.Tuple[t.Any, ...] = ()
+        self._lock = threading.Lock()
 
     def register(self, manager):
-        self._local.append(manager)
+        with self._lock:
+            self._local = self._local + (manager,)
 
     def get(self):
-        try:
-            manager = self._local[-1]
-        except IndexError:
+        local = self._local
+        if not local:
             return
-        return manager
+        return local[-1]
 
     def pop(self):
-        try:
-            manager = self._local.pop()
-            if manager:
-                del manager
-        except KeyError:
-            pass
+        with self._lock:
+            self._local = self._local[:-1]
+
+
+class _ManagerState(t.NamedTuple):
+    """
+    State of a permission manager which changes with the secret key. It is
+    replaced, never mutated, so a request uses one secret and its cache.
+    """
+    secret: str
+    token_cache: t.Optional[TokenCache]
 
 
 @functools.singledispatch
@@ -52,6 +85,32 @@ def _(secret: types.FunctionType, *args):
     return Secret(secret(*args))
 
 
+class VerifiedToken:
+    """
+    Claims of an access token which passed the permission check.
+
+    The object is created once per request by `PermissionManager.verify`
+    and is attached to ``request.state.verified_token``, so endpoints can
+    use the claims without decoding the token again. The claims are a
+    read-only view, the payload is shared by the requests of the token
+    with a token cache or concurrent verifications.
+    """
+
+    __slots__ = ("token", "subject", "scopes", "expires", "claims")
+
+    def __init__(self, token: str, claims: t.Dict[str, t.Any], scopes: t.Iterable[str]):
+        self.token = token
+        self.subject = claims.get("sub")
+        self.scopes = frozenset(scopes)
+        self.expires = claims.get("exp")
+        self.claims: t.Mapping[str, t.Any] = types.MappingProxyType(claims)
+
+    def __repr__(self):
+        return "%s(subject=%r, scopes=%r)" % (
+            type(self).__name__, self.subject, sorted(self.scopes)
+        )
+
+
 class LoginManager(_LoginManager):
 
     def __init__(self,
@@ -63,12 +122,105 @@ class LoginManager(_LoginManager):
                  cookie_name: str = "access-token",
                  custom_exception: Exception = None,
                  default_expiry: timedelta = timedelta(minutes=15),
-                 scopes: t.Dict[str, str] = None
+                 scopes: t.Dict[str, str] = None,
+                 user_cache: t.Optional[UserCache] = None,
+                 session_store: t.Optional[SessionStore] = None
                  ):
         super().__init__(
             secret, token_url, algorithm, use_cookie, use_header, cookie_name,
             custom_exception, default_expiry, scopes
         )
+        self.user_cache = user_cache
+        self.session_store = session_store
+
+    def create_session_token(self,
+                             subject: t.Any,
+                             scopes: t.Iterable[str] = (),
+                             expires: t.Optional[timedelta] = None) -> str:
+        """
+        Creates a session token, a random id of a session in the session store.
+        It is verified by `PermissionManager` without cryptography.
+        Args:
+            subject: The subject of the session, like "sub" of an access token
+            scopes: The scopes granted to the session
+            expires: An optional timedelta in which the session expires.
+                Defaults to the ttl of the session store
+        Returns:
+            The session token
+        """
+        if self.session_store is None:
+            raise ValueError("session_store is not set.")
+        ttl = None if expires is None else expires.total_seconds()
+        return self.session_store.create(subject, scopes, ttl)
+
+    async def _load_user(self, identifier: t.Any):
+        """
+        Loads the user using the user_callback, through the user cache if set.
+        Args:
+            identifier: The user identifier expected by `_user_callback`
+        Returns:
+            The user object returned by `_user_callback` or None
+        """
+        if self.user_cache is None:
+            return await super()._load_user(identifier)
+        return await self.user_cache.get_or_load(identifier, super()._load_user)
+
+    def create_access_tokens(self,
+                             claims: t.Iterable[t.Dict[str, t.Any]],
+                             *,
+                             expires: t.Optional[timedelta] = None,
+                             scopes: t.Optional[t.Collection[str]] = None,
+                             processes: t.Optional[int] = None,
+                             chunksize: int = 256
+                             ) -> t.Iterator[str]:
+        """
+        Creates access tokens for many claims, like `create_access_token`
+        for each of them. The header and the keyed signer are prepared once
+        and tokens are yielded as the claims are consumed.
+        Args:
+            claims: The data which should be stored in each token
+            expires: An optional timedelta in which the tokens expire.
+                Defaults to `default_expiry`
+            scopes: Optional scopes the token users have access to.
+            processes: Number of processes to sign in with asymmetric algorithms.
+                HMAC algorithms always sign in the current process.
+            chunksize: Number of tokens signed per batch.
+        Returns:
+            Iterator of the encoded tokens, in the order of the claims
+        """
+        signer = TokenSigner(str(self.secret), self.algorithm)
+        expires = expires or self.default_expiry
+        unique_scopes = None if scopes is None else list(set(scopes))
+
+        payloads = (
+            self._bulk_payloads(chunk, expires, unique_scopes)
+            for chunk in chunked(claims, chunksize)
+        )
+        if processes is None or signer.is_symmetric:
+            for chunk in payloads:
+                yield from signer.sign_many(chunk)
+            return
+
+        with ProcessPoolExecutor(
+                processes, initializer=_init_signer_worker, initargs=(signer,)
+        ) as executor:
+            for tokens in imap_bounded(executor, _sign_in_worker, payloads, processes * 2):
+                yield from tokens
+
+    @staticmethod
+    def _bulk_payloads(chunk: t.List[t.Dict[str, t.Any]],
+                       expires: timedelta,
+                       scopes: t.Optional[t.List[str]]
+                       ) -> t.List[t.Dict[str, t.Any]]:
+        exp = timegm((datetime.utcnow() + expires).utctimetuple())
+        payloads = []
+        for data in chunk:
+            payload = data.copy()
+            payload["exp"] = exp
+            if scopes is not None:
+                payload["scopes"] = scopes
+            payloads.append(payload)
+        return payloads
 
     def _get_payload_with_extrakey(self, token: str, extra_key: str):
         """
@@ -97,11 +249,32 @@ class LoginManager(_LoginManager):
 class PermissionManager:
 
     """
-
+    Manager which verifies the tokens of requests and checks their scopes.
+    Importing it loads FastAPI and fastapi-login.
     """
-    def __init__(self, manager: LoginManager, perm_key="scopes"):
+    def __init__(self,
+                 manager: LoginManager,
+                 perm_key: t.Union[ClaimPath, t.Sequence[ClaimPath]] = "scopes",
+                 executor: t.Optional[Executor] = None,
+                 verifier: t.Union[HMACVerifier, IntrospectionVerifier, None] = None,
+                 audit: t.Optional[AuditLog] = None,
+                 token_cache: t.Optional[TokenCache] = None,
+                 scope_map: t.Optional[t.Mapping[t.Any, ScopeMap]] = None):
         self._manager = manager
+        self._audit = audit
+        self._state = _ManagerState(str(manager.secret), token_cache)
         self._pem_key = perm_key
+        # compiled once, the claim paths are not parsed per request.
+        self._scopes_of = compile_scope_extractor(perm_key, scope_map)
+        # claim of the scopes in the claims of session tokens.
+        self._scope_claim = perm_key if isinstance(perm_key, str) and "." not in perm_key else "scopes"
+        self._executor = executor
+        self._verifier = verifier
+        # verifiers with a coroutine decode are only usable with verify_async.
+        self._async_verifier = inspect.iscoroutinefunction(getattr(verifier, "decode", None))
+        self._flight = SingleFlight()
+        # session tokens of the login manager are checked before the json web tokens.
+        self._sessions: t.Optional[SessionStore] = getattr(manager, "session_store", None)
         try:
             self._app_name = manager.app_name                      # type:ignore
         except AttributeError:
@@ -113,6 +286,14 @@ class PermissionManager:
     def app_name(self):
         return self._app_name
 
+    @property
+    def audit(self) -> t.Optional[AuditLog]:
+        return self._audit
+
+    @property
+    def token_cache(self) -> t.Optional[TokenCache]:
+        return self._state.token_cache
+
     def _register(self) -> None:
         """
         Method to register permission manager to pro
@@ -137,6 +318,188 @@ class PermissionManager:
         token = await self._manager._get_token(request)
         return token
 
+    def _decode(self,
+                token: str,
+                extra_secret_key: t.Optional[str] = None
+                ) -> t.Optional[t.Dict[str, t.Any]]:
+        """
+        Method to decode the token with the secret key, and then with the
+        extra secret key.
+        :return:
+            Payload of the token or None if the token is invalid.
+        """
+        if self._async_verifier:
+            raise TypeError("%r can only be used with verify_async." % self._verifier)
+        if self._verifier is not None:
+            return self._decode_with_verifier(token, extra_secret_key)
+
+        try:
+            return self._manager._get_payload(token)
+        except type(self._manager.not_authenticated_exception):
+            try:
+                if extra_secret_key is None:
+                    return None
+                return self._manager._get_payload_with_extrakey(token, extra_secret_key)
+            except type(self._manager.not_authenticated_exception):
+                # We got an error while decoding the token
+                return None
+
+    def _decode_with_verifier(self,
+                              token: str,
+                              extra_secret_key: t.Optional[str] = None
+                              ) -> t.Optional[t.Dict[str, t.Any]]:
+        secret = self._state.secret
+        algorithms = [self._manager.algorithm]
+        try:
+            return self._verifier.decode(token, secret, algorithms)          # type: ignore
+        except jwt.PyJWTError:
+            if extra_secret_key is None:
+                return None
+        try:
+            return self._verifier.decode(token, secret + extra_secret_key, algorithms)    # type: ignore
+        except jwt.PyJWTError:
+            return None
+
+    def _check(self,
+               token: str,
+               payload: t.Optional[t.Dict[str, t.Any]],
+               required_scopes: t.Optional[SecurityScopes],
+               scopes: t.Optional[t.Collection[str]] = None
+               ) -> t.Optional[VerifiedToken]:
+        if payload is None:
+            return None
+
+        if scopes is None:
+            scopes = self._scopes_of(payload)
+        # Check if all scopes are present, None when a policy decides.
+
+        if required_scopes is not None and \
+                all(scope not in scopes for scope in required_scopes.scopes):
+            return None
+
+        return VerifiedToken(token, payload, scopes)
+
+    def _check_session(self,
+                       token: str,
+                       session: Session,
+                       required_scopes: t.Optional[SecurityScopes]
+                       ) -> t.Optional[VerifiedToken]:
+        sessions: SessionStore = self._sessions                   # type: ignore
+        if required_scopes is not None and \
+                not session.mask & sessions.mask(required_scopes.scopes):
+            return None
+
+        scopes = sessions.scopes(session.mask)
+        claims = {"sub": session.subject, "exp": int(session.expires), self._scope_claim: sorted(scopes)}
+        return VerifiedToken(token, claims, scopes)
+
+    def verify(self,
+               token: str,
+               required_scopes: t.Optional[SecurityScopes],
+               extra_secret_key: t.Optional[str] = None
+               ) -> t.Optional[VerifiedToken]:
+        """
+        Method to decode the token and check permissions to compare the
+        required scopes and scopes that granted to users.
+        :param token:
+            A access token which identifies the users.
+            type: str
+        :param required_scopes:
+            A scopes specified by developer according to policies,
+            None to only verify the token.
+            type: object
+        :param extra_secret_key:
+            A extra key to be concatenated with the secret key.
+            type: str
+        :return:
+            VerifiedToken if user have permission that resource elsewise None.
+        """
+        if self._sessions is not None:
+            session = self._sessions.get(token)
+            if session is not None:
+                return self._check_session(token, session, required_scopes)
+
+        # the secret is replaced before the state, so the token is decoded with
+        # the secret of the cache or a newer one.
+        cache = self._state.token_cache
+        if cache is None:
+            payload = self._decode(token, extra_secret_key)
+            return self._check(token, payload, required_scopes)
+
+        digest = _token_digest(token, extra_secret_key)
+        entry = cache.get(digest)
+        if entry is None:
+            payload = self._decode(token, extra_secret_key)
+            return self._check(token, payload, required_scopes, self._cache_scopes(cache, digest, payload))
+        payload, scopes = entry
+        if scopes is None:
+            scopes = self._cache_scopes(cache, digest, payload)
+        return self._check(token, payload, required_scopes, scopes)
+
+    async def verify_async(self,
+                           token: str,
+                           required_scopes: t.Optional[SecurityScopes],
+                           extra_secret_key: t.Optional[str] = None
+                           ) -> t.Optional[VerifiedToken]:
+        """
+        Method to verify the token like `verify` without blocking the event loop.
+        When the manager has an executor, the token is decoded in it and
+        concurrent verifications of the same token share one decoding.
+        """
+        if self._sessions is not None:
+            session = self._sessions.get(token)
+            if session is not None:
+                return self._check_session(token, session, required_scopes)
+
+        if self._async_verifier:
+            payload = await self._decode_async(token)
+            return self._check(token, payload, required_scopes)
+
+        if self._executor is None:
+            return self.verify(token, required_scopes, extra_secret_key)
+
+        state = self._state
+        digest = _token_digest(token, extra_secret_key)
+        cache = state.token_cache
+        entry = None if cache is None else cache.get(digest)
+        if entry is not None:
+            payload, scopes = entry
+            if scopes is None:
+                scopes = self._cache_scopes(cache, digest, payload)   # type: ignore
+            return self._check(token, payload, required_scopes, scopes)
+
+        # decodings with a replaced secret are not shared.
+        payload = await self._flight.do(
+            (digest, state.secret), self._decode_in_executor, token, extra_secret_key
+        )
+        if cache is None:
+            return self._check(token, payload, required_scopes)
+        return self._check(token, payload, required_scopes, self._cache_scopes(cache, digest, payload))
+
+    def _cache_scopes(self,
+                      cache: TokenCache,
+                      digest: bytes,
+                      payload: t.Optional[t.Dict[str, t.Any]]
+                      ) -> t.Optional[t.Collection[str]]:
+        # the scopes are extracted once per token, with its payload.
+        scopes = None if payload is None else self._scopes_of(payload)
+        cache.set(digest, payload, scopes)
+        return scopes
+
+    async def _decode_async(self, token: str) -> t.Optional[t.Dict[str, t.Any]]:
+        try:
+            return await self._verifier.decode(                    # type: ignore
+                token, self._state.secret, [self._manager.algorithm]
+            )
+        except jwt.PyJWTError:
+            return None
+
+    async def _decode_in_executor(self, token: str, extra_secret_key: t.Optional[str]):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, self._decode, token, extra_secret_key
+        )
+
     def has_permission(self,
                        token: str,
                        required_scopes: SecurityScopes,
@@ -154,24 +517,25 @@ class PermissionManager:
         :return:
             True if user have permission that resource elsewise False.
         """
-        try:
-            payload = self._manager._get_payload(token)
-        except type(self._manager.not_authenticated_exception):
-            try:
-                if extra_secret_key is None:
-                    return False
-                payload = self._manager._get_payload_with_extrakey(token, extra_secret_key)
-            except type(self._manager.not_authenticated_exception):
-                # We got an error while decoding the token
-                return False
-
-        scopes = payload.get(self._pem_key, [])
-        # Check if all scopes are present
+        return self.verify(token, required_scopes, extra_secret_key) is not None
 
-        if all(scope not in scopes for scope in required_scopes.scopes):
-            return False
+    async def load_user(self, verified_token: VerifiedToken):
+        """
+        Method to load the user of a verified token with the `user_loader`
+        callback of the login manager without decoding the token again.
+        :param verified_token:
+            A token returned by `verify`.
+            type: VerifiedToken
+        :return:
+            The user object returned by the `user_loader` callback.
+        """
+        if verified_token.subject is None:
+            raise self._manager.not_authenticated_exception
 
-        return True
+        user = await self._manager._load_user(verified_token.subject)
+        if user is None:
+            raise self._manager.not_authenticated_exception
+        return user
 
     def set_secret_key(self, secret: t.Union[str, t.Callable], *args) -> None:
         """
@@ -185,6 +549,50 @@ class PermissionManager:
         secret_obj = set_secret(secret, *args)
         self._manager.secret = secret_obj
 
+        # the state is replaced after the secret, and the tokens verified
+        # with the previous secret stay in the previous cache.
+        token_cache = self._state.token_cache
+        if token_cache is not None:
+            token_cache = token_cache.empty()
+        self._state = _ManagerState(str(secret_obj), token_cache)
+
+    def save_token_cache(self, path: str) -> int:
+        """
+        Method to write a snapshot of the token cache, on shutdown.
+        :param path:
+            A path of the snapshot.
+            type: str
+        :return:
+            The number of saved tokens.
+        """
+        state = self._state
+        if state.token_cache is None:
+            raise ValueError("token_cache is not set.")
+        return state.token_cache.save(path, self._token_cache_key(state.secret))
+
+    def load_token_cache(self, path: str) -> int:
+        """
+        Method to restore a snapshot of the token cache, on startup.
+        A snapshot saved with another secret key is ignored.
+        :param path:
+            A path of the snapshot.
+            type: str
+        :return:
+            The number of restored tokens.
+        """
+        state = self._state
+        if state.token_cache is None:
+            raise ValueError("token_cache is not set.")
+        return state.token_cache.load(path, self._token_cache_key(state.secret))
+
+    def _token_cache_key(self, secret: str) -> bytes:
+        # the snapshot is only valid for the secret and algorithm of the manager.
+        return hmac.new(
+            secret.encode(),
+            b"lollol token cache\0" + self._manager.algorithm.encode(),
+            hashlib.sha256
+        ).digest()
+
     def get_secret_key(self) -> Secret:
         """
         Method to get secret key for decoding json web token.
@@ -195,6 +603,26 @@ class PermissionManager:
         return self._manager.secret
 
 
+def _token_digest(token: str, extra_secret_key: t.Optional[str] = None) -> bytes:
+    digest = hashlib.sha256(token.encode())
+    if extra_secret_key is not None:
+        digest.update(b"\0" + extra_secret_key.encode())
+    return digest.digest()
+
+
+def get_verified_token(request: Request) -> t.Optional[VerifiedToken]:
+    """
+    Function to get the verified token which the authorization wrapper
+    attached to the request.
+    :param request:
+        FastApi request object.
+        type: object
+    :return:
+        VerifiedToken or None if the request was not authorized.
+    """
+    return getattr(request.state, _VERIFIED_TOKEN_ATTR, None)
+
+
 def lookup_permission_obj():
 
     obj = _pemission_local.get()
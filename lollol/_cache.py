@@ -0,0 +1,513 @@
+import os
+import hmac
+import json
+import mmap
+import time
+import struct
+import asyncio
+import threading
+import hashlib
+import itertools
+import typing as t
+
+from collections import OrderedDict
+
+
+class CacheStats(t.NamedTuple):
+    hits: int
+    misses: int
+    coalesced: int
+    size: int
+
+
+class TTLCache:
+
+    """
+    Mapping bounded by size which evicts the least recently used entry
+    and drops the entries older than ttl seconds on access. It is safe to
+    use from several threads, see `StripedTTLCache` for contended caches.
+    """
+
+    def __init__(self,
+                 maxsize: int = 1024,
+                 ttl: t.Optional[float] = None,
+                 timer: t.Callable[[], float] = time.monotonic):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive.")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: "OrderedDict[t.Hashable, t.Tuple[float, t.Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires < self._timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: t.Hashable, value: t.Any, ttl: t.Optional[float] = None) -> None:
+        """
+        Method to store a value.
+        :param ttl:
+            Seconds the entry lives, overrides the ttl of the cache.
+            type: float
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = float("inf") if ttl is None else self._timer() + ttl
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> t.Iterator[t.Tuple[t.Hashable, float, t.Any]]:
+        """
+        Method to iterate the live entries as (key, expires, value).
+        """
+        now = self._timer()
+        with self._lock:
+            entries = list(self._data.items())
+        for key, (expires, value) in entries:
+            if expires >= now:
+                yield key, expires, value
+
+    def __contains__(self, key: t.Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class StripedTTLCache:
+
+    """
+    `TTLCache` split in stripes by the hash of the key, each with its own
+    lock, so threads using different keys rarely wait for each other.
+    The least recently used entry is evicted per stripe.
+    """
+
+    def __init__(self,
+                 maxsize: int = 1024,
+                 ttl: t.Optional[float] = None,
+                 timer: t.Callable[[], float] = time.monotonic,
+                 stripes: int = 16):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive.")
+        stripes = max(1, min(stripes, maxsize))
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._stripes = [
+            TTLCache(-(-maxsize // stripes), ttl, timer) for _ in range(stripes)
+        ]
+
+    def _stripe(self, key: t.Hashable) -> TTLCache:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        return self._stripe(key).get(key, default)
+
+    def set(self, key: t.Hashable, value: t.Any, ttl: t.Optional[float] = None) -> None:
+        self._stripe(key).set(key, value, ttl)
+
+    def pop(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        return self._stripe(key).pop(key, default)
+
+    def clear(self) -> None:
+        for stripe in self._stripes:
+            stripe.clear()
+
+    def items(self) -> t.Iterator[t.Tuple[t.Hashable, float, t.Any]]:
+        for stripe in self._stripes:
+            yield from stripe.items()
+
+    def __contains__(self, key: t.Hashable) -> bool:
+        return key in self._stripe(key)
+
+    def __len__(self) -> int:
+        return sum(len(stripe) for stripe in self._stripes)
+
+
+class ReadMostlyCache:
+
+    """
+    Small bounded mapping which is read on every request and rarely written.
+    Reads do not lock, a write replaces the mapping with an updated copy.
+    When it is full the oldest entry is evicted. Concurrent writes may lose
+    an entry, which is computed again.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive.")
+        self.maxsize = maxsize
+        self._data: t.Dict[t.Hashable, t.Any] = {}
+
+    def get(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        return self._data.get(key, default)
+
+    def set(self, key: t.Hashable, value: t.Any) -> None:
+        data = dict(self._data)
+        data.pop(key, None)
+        while len(data) >= self.maxsize:
+            del data[next(iter(data))]
+        data[key] = value
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+
+    """
+    Coalesce concurrent calls with the same key into one awaitable.
+    The first caller starts the call, the others await its result.
+    """
+
+    def __init__(self):
+        self._calls: t.Dict[t.Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self,
+                 key: t.Hashable,
+                 func: t.Callable[..., t.Awaitable],
+                 *args: t.Any) -> t.Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self._calls[key] = future
+            future.add_done_callback(
+                lambda done: self._forget(key, done)
+            )
+        else:
+            self.coalesced += 1
+
+        # a cancelled caller must not cancel the call of the others.
+        return await asyncio.shield(future)
+
+    def _forget(self, key: t.Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    def forget(self, key: t.Hashable) -> None:
+        """
+        Method to make the next call of the key start a new call, the
+        callers of the call in flight still get its result.
+        """
+        self._calls.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class UserCache:
+
+    """
+    Cache of the users returned by the `user_loader` callback.
+
+    Concurrent loads of the same identifier share one call of the callback.
+    A None user is not cached, so a user created later is found. A load in
+    flight when the identifier is invalidated does not cache its user.
+    """
+
+    def __init__(self,
+                 maxsize: int = 1024,
+                 ttl: t.Optional[float] = 60.0,
+                 timer: t.Callable[[], float] = time.monotonic):
+        self._users = TTLCache(maxsize, ttl, timer)
+        self._flight = SingleFlight()
+        # generation of the load in flight by identifier.
+        self._loading: t.Dict[t.Hashable, int] = {}
+        self._generations = itertools.count()
+        self._hits = 0
+        self._misses = 0
+
+    async def get_or_load(self,
+                          identifier: t.Hashable,
+                          loader: t.Callable[[t.Any], t.Awaitable]) -> t.Any:
+        """
+        Method to get a user from the cache or load it with the loader.
+        :param identifier:
+            A user identifier expected by the loader.
+            type: Any
+        :param loader:
+            A coroutine function which loads the user.
+            type: callable
+        :return:
+            The user object or None
+        """
+        user = self._users.get(identifier, _MISSING)
+        if user is not _MISSING:
+            self._hits += 1
+            return user
+
+        self._misses += 1
+        return await self._flight.do(identifier, self._load, identifier, loader)
+
+    async def _load(self, identifier: t.Hashable, loader: t.Callable) -> t.Any:
+        generation = self._loading[identifier] = next(self._generations)
+        try:
+            user = await loader(identifier)
+        finally:
+            # an invalidation or a newer load replaced the generation.
+            current = self._loading.get(identifier) == generation
+            if current:
+                del self._loading[identifier]
+        if user is not None and current:
+            self._users.set(identifier, user)
+        return user
+
+    def invalidate(self, identifier: t.Hashable) -> None:
+        self._loading.pop(identifier, None)
+        self._flight.forget(identifier)
+        self._users.pop(identifier)
+
+    def clear(self) -> None:
+        for identifier in list(self._loading):
+            self._flight.forget(identifier)
+        self._loading.clear()
+        self._users.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            self._hits, self._misses, self._flight.coalesced, len(self._users)
+        )
+
+
+class ResponseCache:
+
+    """
+    Cache of the results of protected GET endpoints by route, path and query
+    parameters and the scopes of the caller.
+
+    A hit is served after the permission check passes, without calling the
+    endpoint. Concurrent misses of the same key share one call of the
+    endpoint. Only endpoints whose result depends on nothing else than
+    the key may use the cache, not the ones which return data of the user.
+    """
+
+    def __init__(self,
+                 maxsize: int = 1024,
+                 ttl: t.Optional[float] = 60.0,
+                 timer: t.Callable[[], float] = time.monotonic):
+        self._responses = TTLCache(maxsize, ttl, timer)
+        self._flight = SingleFlight()
+        self._hits = 0
+        self._misses = 0
+
+    async def get_or_load(self,
+                          key: t.Hashable,
+                          loader: t.Callable[[], t.Awaitable],
+                          cacheable: t.Callable[[t.Any], bool] = lambda value: True) -> t.Any:
+        """
+        Method to get a result from the cache or load it with the loader.
+        :param key:
+            A key of the route, the parameters and the scopes.
+            type: tuple
+        :param loader:
+            A coroutine function which calls the endpoint.
+            type: callable
+        :param cacheable:
+            A function which tells if the result may be cached.
+            type: callable
+        :return:
+            The result of the endpoint
+        """
+        entry = self._responses.get(key)
+        if entry is not None:
+            self._hits += 1
+            return entry[0]
+
+        self._misses += 1
+        return await self._flight.do(key, self._load, key, loader, cacheable)
+
+    async def _load(self, key: t.Hashable, loader: t.Callable, cacheable: t.Callable) -> t.Any:
+        result = await loader()
+        if cacheable(result):
+            # a None result is cached too.
+            self._responses.set(key, (result,))
+        return result
+
+    def clear(self) -> None:
+        self._responses.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            self._hits, self._misses, self._flight.coalesced, len(self._responses)
+        )
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+
+class TokenCache:
+
+    """
+    Cache of the payloads of verified tokens and their scopes by the digest
+    of the token, so a token is decoded once until it expires.
+
+    A snapshot of the cache can be saved on shutdown and loaded on startup,
+    so new workers do not verify the active tokens again. The snapshot is
+    signed with a key derived from the secret of the manager: it is ignored
+    when the secret changed, and expired entries are dropped on load.
+    """
+
+    # magic, version, fingerprint of the key, number of entries
+    _HEADER = struct.Struct("<4sB32sI")
+    # digest of the token, expires, length of the payload
+    _ENTRY = struct.Struct("<32sdI")
+    _MAGIC = b"LLTC"
+    _VERSION = 1
+
+    def __init__(self,
+                 maxsize: int = 10000,
+                 max_ttl: t.Optional[float] = None,
+                 timer: t.Callable[[], float] = time.time,
+                 stripes: int = 16):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.stripes = stripes
+        self._timer = timer
+        self._payloads = StripedTTLCache(maxsize, timer=timer, stripes=stripes)
+
+    def empty(self) -> "TokenCache":
+        """
+        Method to create an empty cache with the same settings.
+        """
+        return type(self)(self.maxsize, self.max_ttl, self._timer, self.stripes)
+
+    def get(self, digest: bytes) -> t.Optional[t.Tuple[t.Dict[str, t.Any], t.Optional[t.Collection[str]]]]:
+        """
+        Method to get the payload and scopes of a token, the scopes are
+        None when the entry was loaded from a snapshot.
+        """
+        return self._payloads.get(digest)
+
+    def set(self,
+            digest: bytes,
+            payload: t.Optional[t.Dict[str, t.Any]],
+            scopes: t.Optional[t.Collection[str]] = None) -> None:
+        """
+        Method to cache the payload of a verified token and its scopes until
+        it expires. Invalid tokens are not cached.
+        """
+        if payload is None:
+            return
+
+        ttl = self.max_ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            ttl = min(exp - self._timer(), ttl if ttl is not None else float("inf"))
+            if ttl <= 0:
+                return
+        self._payloads.set(digest, (payload, scopes), ttl)
+
+    def clear(self) -> None:
+        self._payloads.clear()
+
+    def save(self, path: str, key: bytes) -> int:
+        """
+        Method to write a snapshot of the live entries, only readable by its
+        owner and signed with the key.
+        :return:
+            The number of saved entries.
+        """
+        chunks = []
+        # scopes depend on the manager, they are extracted again.
+        for digest, expires, (payload, _) in self._payloads.items():
+            data = json.dumps(payload, separators=(",", ":")).encode()
+            chunks.append(self._ENTRY.pack(digest, expires, len(data)))
+            chunks.append(data)
+        count = len(chunks) // 2
+        body = self._HEADER.pack(self._MAGIC, self._VERSION, _fingerprint(key), count) + b"".join(chunks)
+
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+            f.write(hmac.new(key, body, hashlib.sha256).digest())
+        os.replace(temp_path, path)
+        return count
+
+    def load(self, path: str, key: bytes) -> int:
+        """
+        Method to restore the entries of a snapshot. A missing snapshot or a
+        snapshot of another key is ignored.
+        :raise:
+            ValueError if the snapshot is corrupted.
+        :return:
+            The number of restored entries.
+        """
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return 0
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self._HEADER.size + 32:
+                raise ValueError("%s is not a token cache snapshot." % path)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self._load(data, size, key)
+
+    def _load(self, data: mmap.mmap, size: int, key: bytes) -> int:
+        magic, version, fingerprint, count = self._HEADER.unpack_from(data)
+        if magic != self._MAGIC or version != self._VERSION:
+            raise ValueError("unsupported token cache snapshot.")
+        if not hmac.compare_digest(fingerprint, _fingerprint(key)):
+            # saved with another secret.
+            return 0
+
+        body = memoryview(data)[:size - 32]
+        try:
+            tag = hmac.new(key, body, hashlib.sha256).digest()
+        finally:
+            body.release()
+        if not hmac.compare_digest(tag, data[size - 32:size]):
+            raise ValueError("token cache snapshot is corrupted.")
+
+        now = self._timer()
+        restored = 0
+        offset = self._HEADER.size
+        for _ in range(count):
+            digest, expires, length = self._ENTRY.unpack_from(data, offset)
+            offset += self._ENTRY.size
+            if expires > now:
+                payload = json.loads(data[offset:offset + length])
+                self._payloads.set(digest, (payload, None), expires - now)
+                restored += 1
+            offset += length
+        return restored
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+
+def _fingerprint(key: bytes) -> bytes:
+    return hashlib.sha256(b"fingerprint\0" + key).digest()
+
+
+_MISSING = object()
@@ -0,0 +1,104 @@
+import typing as t
+
+
+# "realm_access.roles", or the keys when a key contains a dot.
+ClaimPath = t.Union[str, t.Sequence[str]]
+ScopeMap = t.Mapping[str, t.Union[str, t.Iterable[str]]]
+
+Scopes = t.Collection[str]
+Extractor = t.Callable[[t.Dict[str, t.Any]], Scopes]
+
+_SEQUENCES = (list, tuple, set, frozenset)
+
+
+def _keys(path: ClaimPath) -> t.Tuple[str, ...]:
+    keys = tuple(path.split(".")) if isinstance(path, str) else tuple(path)
+    if not keys or not all(keys):
+        raise ValueError("invalid claim path %r." % (path,))
+    return keys
+
+
+def _getter(keys: t.Tuple[str, ...]) -> t.Callable[[t.Dict[str, t.Any]], t.Any]:
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda payload: payload.get(key)
+
+    def get(payload: t.Dict[str, t.Any]) -> t.Any:
+        value: t.Any = payload
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+
+def _table(scope_map: ScopeMap) -> t.Dict[str, t.Tuple[str, ...]]:
+    return {
+        value: (scopes,) if isinstance(scopes, str) else tuple(scopes)
+        for value, scopes in scope_map.items()
+    }
+
+
+def compile_scope_extractor(
+        perm_key: t.Union[ClaimPath, t.Sequence[ClaimPath]] = "scopes",
+        scope_map: t.Optional[t.Mapping[t.Any, ScopeMap]] = None
+) -> Extractor:
+    """
+    Function to compile the claims which grant scopes into an extractor of
+    the scopes of a payload.
+    :param perm_key:
+        A claim path or a list of them, like "realm_access.roles", a path
+        is a tuple of keys when a key has a dot. A claim may be a list or a
+        string of space separated scopes.
+        type: str or list
+    :param scope_map:
+        Tables by claim path which map a value of the claim to scopes,
+        values without mapping are scopes themselves.
+        type: dict
+    :return:
+        A function of the payload which returns the scopes.
+    """
+    paths: t.List[ClaimPath] = [perm_key] if isinstance(perm_key, str) else list(perm_key)
+    if not paths:
+        raise ValueError("perm_key must have a claim.")
+
+    tables = {}
+    for path, table in (scope_map or {}).items():
+        tables[_keys(path)] = _table(table)
+    unknown = set(tables) - {_keys(path) for path in paths}
+    if unknown:
+        raise ValueError("scope_map has claims which are not in perm_key: %r" % sorted(unknown))
+
+    if len(paths) == 1 and not tables and len(_keys(paths[0])) == 1:
+        # the top level claim is used as it is, like before.
+        key = _keys(paths[0])[0]
+
+        def extract_claim(payload: t.Dict[str, t.Any]) -> Scopes:
+            value = payload.get(key)
+            if isinstance(value, str):
+                return value.split()
+            # null or a number grants no scopes.
+            return value if isinstance(value, _SEQUENCES) else ()
+        return extract_claim
+
+    getters = [(_getter(_keys(path)), tables.get(_keys(path))) for path in paths]
+
+    def extract(payload: t.Dict[str, t.Any]) -> Scopes:
+        scopes: t.Set[str] = set()
+        for get, table in getters:
+            value = get(payload)
+            if isinstance(value, str):
+                value = value.split()
+            elif not isinstance(value, _SEQUENCES):
+                continue
+            for item in value:
+                if not isinstance(item, str):
+                    continue
+                mapped = None if table is None else table.get(item)
+                if mapped is None:
+                    scopes.add(item)
+                else:
+                    scopes.update(mapped)
+        return frozenset(scopes)
+    return extract
@@ -1,3 +1,6 @@
+from jwt import InvalidTokenError
+
+
 class AuthorizationError(Exception):
 
     """
@@ -9,3 +12,15 @@ class ScopeNotSpecified(Exception):
     """
     When scopes does not specified
     """
+
+
+class IntrospectionError(InvalidTokenError):
+    """
+    When the introspection endpoint can not be reached or failed
+    """
+
+
+class PolicySyntaxError(ValueError):
+    """
+    When a policy can not be compiled
+    """
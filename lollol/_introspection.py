@@ -0,0 +1,192 @@
+import time
+import typing as t
+
+from jwt import InvalidTokenError
+
+from ._cache import SingleFlight
+from ._cache import TTLCache
+from ._exceptions import IntrospectionError
+
+
+class CircuitBreaker:
+
+    """
+    Circuit breaker of an upstream service.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    are refused for reset_timeout seconds. Then one trial call is allowed,
+    which closes the circuit on success or opens it again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 timer: t.Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._timer = timer
+        self._failures = 0
+        self._opened_at: t.Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._timer() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._trial or self._failures >= self.failure_threshold:
+            self._opened_at = self._timer()
+        self._trial = False
+
+
+class IntrospectionVerifier:
+
+    """
+    Verifier of opaque tokens with an OAuth 2.0 token introspection
+    endpoint (RFC 7662) which can be set as the verifier of `PermissionManager`.
+
+    Requests share a pool of connections of a httpx.AsyncClient. The
+    responses are cached until the `exp` they return, at most max_ttl seconds,
+    and inactive tokens for negative_ttl seconds. Concurrent lookups of the
+    same token share one request. When the endpoint fails or is slower than
+    timeout failure_threshold times in a row, tokens are refused without
+    calling it for reset_timeout seconds.
+
+    The space separated `scope` of the response is returned as a list under
+    `scopes`, the default permission key.
+    """
+
+    def __init__(self,
+                 url: str,
+                 client_id: t.Optional[str] = None,
+                 client_secret: t.Optional[str] = None,
+                 *,
+                 timeout: float = 2.0,
+                 max_connections: int = 100,
+                 cache_size: int = 10000,
+                 max_ttl: float = 300.0,
+                 negative_ttl: float = 5.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 client: t.Any = None):
+        self.url = url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._auth = None
+        if client_id is not None:
+            self._auth = (client_id, client_secret or "")
+        self._client = client
+        self._responses = TTLCache(cache_size)
+        self._flight = SingleFlight()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def _get_client(self):
+        if self._client is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError(
+                    "IntrospectionVerifier requires httpx, install lollol[introspection]."
+                ) from None
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections),
+            )
+        return self._client
+
+    async def decode(self,
+                     token: str,
+                     key: t.Optional[str] = None,
+                     algorithms: t.Optional[t.List[str]] = None) -> t.Dict[str, t.Any]:
+        """
+        Method to introspect a token. key and algorithms are not used, they
+        keep the signature of the other verifiers.
+        :param token:
+            A opaque access token.
+            type: str
+        :return:
+            The introspection response of the active token.
+        :raise:
+            jwt.InvalidTokenError if the token is not active or the endpoint failed.
+        """
+        response = self._responses.get(token)
+        if response is None:
+            response = await self._flight.do(token, self._introspect, token)
+
+        if not response.get("active"):
+            raise InvalidTokenError("Token is not active")
+        return response
+
+    async def _introspect(self, token: str) -> t.Dict[str, t.Any]:
+        if not self.breaker.allow():
+            raise IntrospectionError("Introspection circuit is open")
+
+        try:
+            reply = await self._get_client().post(
+                self.url,
+                data={"token": token, "token_type_hint": "access_token"},
+                auth=self._auth,
+                headers={"Accept": "application/json"},
+            )
+            reply.raise_for_status()
+            response = reply.json()
+        except Exception as e:
+            self.breaker.record_failure()
+            raise IntrospectionError("Introspection failed: %r" % e) from e
+        self.breaker.record_success()
+
+        if not isinstance(response, dict):
+            raise IntrospectionError("Invalid introspection response")
+        exp = response.get("exp")
+        if exp is not None and (isinstance(exp, bool) or not isinstance(exp, (int, float))):
+            raise IntrospectionError("Invalid introspection response: exp must be a number")
+        self._store(token, response)
+        return response
+
+    def _store(self, token: str, response: t.Dict[str, t.Any]) -> None:
+        if not response.get("active"):
+            self._responses.set(token, response, self.negative_ttl)
+            return
+
+        ttl = self.max_ttl
+        exp = response.get("exp")
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+            if ttl <= 0:
+                response["active"] = False
+                return
+
+        scope = response.get("scope")
+        if isinstance(scope, str) and "scopes" not in response:
+            response["scopes"] = scope.split()
+        self._responses.set(token, response, ttl)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,294 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+import typing as t
+
+import jwt
+
+from calendar import timegm
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import (
+    DecodeError,
+    ExpiredSignatureError,
+    ImmatureSignatureError,
+    InvalidAlgorithmError,
+    InvalidAudienceError,
+    InvalidIssuedAtError,
+    InvalidSignatureError,
+)
+
+from ._cache import ReadMostlyCache
+
+try:
+    import orjson                                                 # type: ignore
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+_TIME_CLAIMS = ("exp", "iat", "nbf")
+# claims of other algorithms are validated like the claims of HMAC tokens.
+_NO_CLAIM_VALIDATION = {"verify_exp": False, "verify_nbf": False, "verify_iat": False, "verify_aud": False}
+
+
+def base64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).replace(b"=", b"")
+
+
+def base64url_decode(data: bytes) -> bytes:
+    rem = len(data) % 4
+    if rem > 0:
+        data += b"=" * (4 - rem)
+    return base64.urlsafe_b64decode(data)
+
+
+class TokenSigner:
+
+    """
+    Signer of json web tokens for one secret and algorithm.
+
+    The encoded header segment and the keyed signer are computed once,
+    so signing a token only serializes and signs its payload.
+    Tokens are the same as the tokens of `jwt.encode`.
+    """
+
+    __slots__ = ("secret", "algorithm", "_signing_prefix", "_hmac", "_alg_obj", "_key")
+
+    def __init__(self, secret: str, algorithm: str = "HS256"):
+        algorithms = get_default_algorithms()
+        if algorithm not in algorithms:
+            raise NotImplementedError("Algorithm not supported")
+
+        self.secret = secret
+        self.algorithm = algorithm
+
+        # same header and order of keys as PyJWT
+        header = json.dumps({"typ": "JWT", "alg": algorithm}, separators=(",", ":"))
+        self._signing_prefix = base64url_encode(header.encode()) + b"."
+
+        self._alg_obj = algorithms[algorithm]
+        self._key = self._alg_obj.prepare_key(secret)
+        self._hmac = None
+        if algorithm in _HMAC_DIGESTS:
+            self._hmac = hmac.new(self._key, digestmod=_HMAC_DIGESTS[algorithm])
+
+    @property
+    def is_symmetric(self) -> bool:
+        return self._hmac is not None
+
+    def sign(self, payload: t.Dict[str, t.Any]) -> str:
+        """
+        Method to encode and sign a payload.
+        :param payload:
+            Claims of the token. datetime values of exp, iat and nbf are
+            converted to a timestamp.
+            type: dict
+        :return:
+            The encoded json web token.
+        """
+        for claim in _TIME_CLAIMS:
+            if isinstance(payload.get(claim), datetime):
+                payload = dict(payload)
+                payload[claim] = timegm(payload[claim].utctimetuple())
+
+        signing_input = self._signing_prefix + base64url_encode(
+            json.dumps(payload, separators=(",", ":")).encode()
+        )
+        if self._hmac is not None:
+            mac = self._hmac.copy()
+            mac.update(signing_input)
+            signature = mac.digest()
+        else:
+            signature = self._alg_obj.sign(signing_input, self._key)
+
+        return (signing_input + b"." + base64url_encode(signature)).decode()
+
+    def sign_many(self, payloads: t.Iterable[t.Dict[str, t.Any]]) -> t.List[str]:
+        return [self.sign(payload) for payload in payloads]
+
+    def __reduce__(self):
+        # keyed objects are not picklable, a process rebuilds them.
+        return type(self), (self.secret, self.algorithm)
+
+
+_worker_signer: t.Optional[TokenSigner] = None
+
+
+def _init_signer_worker(signer: TokenSigner) -> None:
+    global _worker_signer
+    _worker_signer = signer
+
+
+def _sign_in_worker(payloads: t.List[t.Dict[str, t.Any]]) -> t.List[str]:
+    return _worker_signer.sign_many(payloads)                     # type: ignore
+
+
+class HMACVerifier:
+
+    """
+    Verifier of HMAC signed json web tokens which can replace `jwt.decode`
+    on `PermissionManager`.
+
+    A pre-keyed hmac object is kept per secret and copied per token, the
+    decoded headers are reused, and the claims are validated like
+    `jwt.decode` with the default options. Tokens of other algorithms are
+    passed to `jwt.decode`.
+    If orjson is installed it parses the payload unless json_loads is given.
+    """
+
+    def __init__(self,
+                 json_loads: t.Optional[t.Callable[[bytes], t.Any]] = None,
+                 leeway: t.Union[float, timedelta] = 0,
+                 maxkeys: int = 8):
+        if isinstance(leeway, timedelta):
+            leeway = leeway.total_seconds()
+        self.leeway = leeway
+        self._json_loads = json_loads or _json_loads
+        # extra secret keys come from requests, so the keyed objects are bounded.
+        # they are read by every verification, the reads do not lock.
+        self._macs = ReadMostlyCache(maxkeys)
+        self._headers = ReadMostlyCache(32)
+
+    def decode(self,
+               token: t.Union[str, bytes],
+               key: str,
+               algorithms: t.List[str]) -> t.Dict[str, t.Any]:
+        """
+        Method to verify and decode a token.
+        :param token:
+            A json web token.
+            type: str
+        :param key:
+            A secret key.
+            type: str
+        :param algorithms:
+            Allowed algorithms.
+            type: list
+        :return:
+            Payload of the token.
+        :raise:
+            jwt.PyJWTError when the token is invalid.
+        """
+        claims = self._decode_signed(token, key, algorithms)
+        self._validate_claims(claims)
+        return claims
+
+    def _decode_signed(self,
+                       token: t.Union[str, bytes],
+                       key: str,
+                       algorithms: t.List[str]) -> t.Dict[str, t.Any]:
+        # the signature is verified, the claims are not validated.
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        if not isinstance(token, bytes):
+            raise DecodeError(f"Invalid token type. Token must be a {bytes}")
+
+        try:
+            signing_input, crypto_segment = token.rsplit(b".", 1)
+            header_segment, payload_segment = signing_input.split(b".", 1)
+        except ValueError as err:
+            raise DecodeError("Not enough segments") from err
+
+        header = self._load_header(header_segment)
+        alg = header.get("alg")
+        if alg not in _HMAC_DIGESTS:
+            return jwt.decode(token, key, algorithms=algorithms,  # type: ignore
+                              options=_NO_CLAIM_VALIDATION)
+
+        try:
+            payload = base64url_decode(payload_segment)
+        except (TypeError, binascii.Error) as err:
+            raise DecodeError("Invalid payload padding") from err
+        try:
+            signature = base64url_decode(crypto_segment)
+        except (TypeError, binascii.Error) as err:
+            raise DecodeError("Invalid crypto padding") from err
+
+        if header.get("b64", True) is False:
+            raise DecodeError(
+                'It is required that you pass in a value for the "detached_payload" '
+                'argument to decode a message having the b64 header set to false.'
+            )
+        if alg not in algorithms:
+            raise InvalidAlgorithmError("The specified alg value is not allowed")
+
+        mac = self._get_mac(key, alg)
+        mac.update(signing_input)
+        if not hmac.compare_digest(mac.digest(), signature):
+            raise InvalidSignatureError("Signature verification failed")
+
+        try:
+            claims = self._json_loads(payload)
+        except ValueError as e:
+            raise DecodeError(f"Invalid payload string: {e}")
+        if not isinstance(claims, dict):
+            raise DecodeError("Invalid payload string: must be a json object")
+        return claims
+
+    def _load_header(self, header_segment: bytes) -> t.Mapping[str, t.Any]:
+        header = self._headers.get(header_segment)
+        if header is not None:
+            return header
+
+        try:
+            header_data = base64url_decode(header_segment)
+        except (TypeError, binascii.Error) as err:
+            raise DecodeError("Invalid header padding") from err
+        try:
+            header = json.loads(header_data)
+        except ValueError as e:
+            raise DecodeError(f"Invalid header string: {e}") from e
+        if not isinstance(header, Mapping):
+            raise DecodeError("Invalid header string: must be a json object")
+
+        self._headers.set(header_segment, header)
+        return header
+
+    def _get_mac(self, key: str, alg: str) -> "hmac.HMAC":
+        mac = self._macs.get((key, alg))
+        if mac is None:
+            prepared = get_default_algorithms()[alg].prepare_key(key)
+            mac = hmac.new(prepared, digestmod=_HMAC_DIGESTS[alg])
+            self._macs.set((key, alg), mac)
+        return mac.copy()
+
+    def _validate_claims(self, claims: t.Dict[str, t.Any]) -> None:
+        now = int(time.time())
+        leeway = self.leeway
+
+        if "iat" in claims:
+            try:
+                int(claims["iat"])
+            except (TypeError, ValueError):
+                raise InvalidIssuedAtError("Issued At claim (iat) must be an integer.")
+
+        if "nbf" in claims:
+            try:
+                nbf = int(claims["nbf"])
+            except (TypeError, ValueError):
+                raise DecodeError("Not Before claim (nbf) must be an integer.")
+            if nbf > (now + leeway):
+                raise ImmatureSignatureError("The token is not yet valid (nbf)")
+
+        if "exp" in claims:
+            try:
+                exp = int(claims["exp"])
+            except (TypeError, ValueError):
+                raise DecodeError("Expiration Time claim (exp) must be an integer.")
+            if exp < (now - leeway):
+                raise ExpiredSignatureError("Signature has expired")
+
+        # no audience is expected, like jwt.decode without audience.
+        if claims.get("aud"):
+            raise InvalidAudienceError("Invalid audience")
@@ -0,0 +1,265 @@
+import functools
+import operator
+import re
+import types
+import typing as t
+
+from ._cache import StripedTTLCache
+from ._exceptions import PolicySyntaxError
+
+
+# expression := or ; or := and ("or" and)* ; and := not ("and" not)*
+# not := "not" not | comparison ; comparison := operand (op operand)?
+# op := "==" | "!=" | "<" | "<=" | ">" | ">=" | "in" | "not in"
+# operand := string | number | true | false | null | "(" expression ")"
+#          | scopes | claim.name[.name] | path.name | query.name
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>'[^']*'|"[^"]*")
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<op>==|!=|<=|>=|<|>|\(|\))
+      | (?P<name>[A-Za-z_][A-Za-z0-9_\-]*(?:\.[A-Za-z_][A-Za-z0-9_\-]*)*)
+    )""", re.VERBOSE)
+
+_KEYWORDS = {"and", "or", "not", "in"}
+_CONSTANTS = {"true": True, "false": False, "null": None}
+_ORDERINGS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+Evaluator = t.Callable[[t.Any, t.Any], t.Any]
+
+
+def _tokenize(source: str) -> t.List[t.Tuple[str, str]]:
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKEN_PATTERN.match(source, position)
+        if match is None or match.end() == position:
+            raise PolicySyntaxError(
+                "invalid policy at %d: %r" % (position, source[position:])
+            )
+        kind: str = match.lastgroup                               # type: ignore
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.position = 0
+        # names of path and query parameters the policy reads.
+        self.inputs: t.List[t.Tuple[str, str]] = []
+
+    def parse(self) -> Evaluator:
+        evaluate = self._or()
+        if self.position != len(self.tokens):
+            self._error("unexpected %r" % self.tokens[self.position][1])
+        return evaluate
+
+    def _error(self, message: str):
+        raise PolicySyntaxError("%s in policy %r" % (message, self.source))
+
+    def _peek(self) -> t.Optional[str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][1]
+        return None
+
+    def _next(self) -> t.Tuple[str, str]:
+        if self.position >= len(self.tokens):
+            self._error("unexpected end")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _or(self) -> Evaluator:
+        operands = [self._and()]
+        while self._peek() == "or":
+            self.position += 1
+            operands.append(self._and())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda token, request: any(operand(token, request) for operand in operands)
+
+    def _and(self) -> Evaluator:
+        operands = [self._not()]
+        while self._peek() == "and":
+            self.position += 1
+            operands.append(self._not())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda token, request: all(operand(token, request) for operand in operands)
+
+    def _not(self) -> Evaluator:
+        if self._peek() == "not":
+            self.position += 1
+            operand = self._not()
+            return lambda token, request: not operand(token, request)
+        return self._comparison()
+
+    def _comparison(self) -> Evaluator:
+        left = self._operand()
+        op = self._peek()
+        if op == "not" and self.position + 1 < len(self.tokens) \
+                and self.tokens[self.position + 1][1] == "in":
+            self.position += 2
+            right = self._operand()
+            return lambda token, request: not _contains(right(token, request), left(token, request))
+        if op not in ("==", "!=", "in") and op not in _ORDERINGS:
+            return left
+
+        self.position += 1
+        right = self._operand()
+        if op in _ORDERINGS:
+            compare = _ORDERINGS[op]                              # type: ignore
+            return lambda token, request: _order(compare, left(token, request), right(token, request))
+        if op == "==":
+            return lambda token, request: _equals(left(token, request), right(token, request))
+        if op == "!=":
+            return lambda token, request: not _equals(left(token, request), right(token, request))
+        return lambda token, request: _contains(right(token, request), left(token, request))
+
+    def _operand(self) -> Evaluator:
+        kind, value = self._next()
+        if kind == "string":
+            literal: t.Any = value[1:-1]
+            return lambda token, request: literal
+        if kind == "number":
+            literal = float(value) if "." in value else int(value)
+            return lambda token, request: literal
+        if value == "(":
+            evaluate = self._or()
+            if self._next()[1] != ")":
+                self._error("missing ')'")
+            return evaluate
+        if kind != "name" or value in _KEYWORDS:
+            self._error("unexpected %r" % value)
+
+        if value in _CONSTANTS:
+            constant = _CONSTANTS[value]
+            return lambda token, request: constant
+        if value == "scopes":
+            return lambda token, request: token.scopes
+
+        source, _, path = value.partition(".")
+        if source == "claim" and path:
+            keys = path.split(".")
+            return lambda token, request: _lookup(token.claims, keys)
+        if source in ("path", "query") and path and "." not in path:
+            self.inputs.append((source, path))
+            if source == "path":
+                return lambda token, request: request.path_params.get(path)
+            return lambda token, request: request.query_params.get(path)
+        return self._error("unknown name %r" % value)
+
+
+_MAPPINGS = (dict, types.MappingProxyType)
+
+
+def _lookup(claims: t.Any, keys: t.List[str]) -> t.Any:
+    for key in keys:
+        if not isinstance(claims, _MAPPINGS):
+            return None
+        claims = claims.get(key)
+    return claims
+
+
+def _equals(left: t.Any, right: t.Any) -> bool:
+    # path and query parameters are strings, claims may be numbers.
+    if isinstance(left, str) != isinstance(right, str):
+        if isinstance(left, (int, float)) and not isinstance(left, bool):
+            return str(left) == right
+        if isinstance(right, (int, float)) and not isinstance(right, bool):
+            return left == str(right)
+    return left == right
+
+
+def _order(compare: t.Callable[[t.Any, t.Any], bool], left: t.Any, right: t.Any) -> bool:
+    if isinstance(left, str) and isinstance(right, (int, float)):
+        left = _number(left)
+    elif isinstance(right, str) and isinstance(left, (int, float)):
+        right = _number(right)
+    try:
+        return compare(left, right)
+    except TypeError:
+        # missing claims and values of other types are not ordered.
+        return False
+
+
+def _number(value: str) -> t.Any:
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _contains(container: t.Any, item: t.Any) -> bool:
+    try:
+        return item in container
+    except TypeError:
+        return False
+
+
+class Policy:
+
+    """
+    Attribute based authorization rule compiled into closures, such as
+
+        'orders:write' in scopes and claim.tenant == path.tenant_id and claim.mfa
+
+    Decisions are cached by the token, which fingerprints the claims, its
+    scopes, which depend on the permission manager, and the values of the
+    path and query parameters the rule reads.
+    """
+
+    __slots__ = ("source", "_evaluate", "_inputs", "_decisions")
+
+    def __init__(self, source: str, cache_size: int = 4096):
+        parser = _Parser(source)
+        self.source = source
+        self._evaluate = parser.parse()
+        self._inputs = tuple(dict.fromkeys(parser.inputs))
+        self._decisions = StripedTTLCache(cache_size)
+
+    def allows(self, token: t.Any, request: t.Any) -> bool:
+        """
+        Method to decide whether the verified token may access the request.
+        :param token:
+            A verified token.
+            type: VerifiedToken
+        :param request:
+            FastApi request object.
+            type: object
+        :return:
+            True if the rule holds.
+        """
+        # managers with other claim paths grant the same token other scopes.
+        key: t.Tuple[t.Any, ...] = (token.token, token.scopes)
+        if self._inputs:
+            path_params = request.path_params
+            query_params = request.query_params
+            key += tuple(
+                (path_params if source == "path" else query_params).get(name)
+                for source, name in self._inputs
+            )
+
+        decision = self._decisions.get(key)
+        if decision is None:
+            decision = bool(self._evaluate(token, request))
+            self._decisions.set(key, decision)
+        return decision
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.source)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_policy(source: str) -> Policy:
+    """
+    Function to compile a policy once, the routes with the same rule share it.
+    :raise:
+        PolicySyntaxError if the rule is not valid.
+    """
+    return Policy(source)
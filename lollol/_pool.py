@@ -0,0 +1,51 @@
+import itertools
+import typing as t
+
+from collections import deque
+from concurrent.futures import Executor, Future
+
+
+T = t.TypeVar("T")
+R = t.TypeVar("R")
+
+
+def chunked(iterable: t.Iterable[T], size: int) -> t.Iterator[t.List[T]]:
+    """
+    Function to split an iterable into lists of size items.
+    The last list may be shorter.
+    """
+    if size <= 0:
+        raise ValueError("size must be positive.")
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_bounded(executor: Executor,
+                 func: t.Callable[[T], R],
+                 iterable: t.Iterable[T],
+                 window: int) -> t.Iterator[R]:
+    """
+    Function like `Executor.map` which keeps at most window calls in flight,
+    so the memory does not grow with the size of the iterable.
+    Results are yielded in the order of the iterable.
+    """
+    if window <= 0:
+        raise ValueError("window must be positive.")
+
+    pending: "deque[Future]" = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
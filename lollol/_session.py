@@ -0,0 +1,209 @@
+import json
+import os
+import secrets
+import threading
+import time
+import typing as t
+
+from ._cache import StripedTTLCache
+
+
+class Session:
+
+    """
+    Compact record of a session, the scopes are bits of the store. ttl is
+    the lifetime of the session, its expiry slides by it.
+    """
+
+    __slots__ = ("subject", "mask", "expires", "ttl")
+
+    def __init__(self, subject: t.Any, mask: int, expires: float, ttl: float):
+        self.subject = subject
+        self.mask = mask
+        self.expires = expires
+        self.ttl = ttl
+
+
+class SessionStore:
+
+    """
+    Bounded in-process store of sessions, the server side alternative of
+    json web tokens. A session token is a random id mapped to a `Session`,
+    so a lookup is a dict access without cryptography.
+
+    With sliding expiry a session lives its ttl seconds after its last use.
+    The least recently used session of a stripe is evicted when the stripe
+    is full, the sessions are split in stripes with their own lock.
+    """
+
+    def __init__(self,
+                 maxsize: int = 100000,
+                 ttl: float = 900.0,
+                 *,
+                 sliding: bool = True,
+                 id_bytes: int = 16,
+                 timer: t.Callable[[], float] = time.time,
+                 stripes: int = 16):
+        self.ttl = ttl
+        self.sliding = sliding
+        self.id_bytes = id_bytes
+        self._timer = timer
+        self._sessions = StripedTTLCache(maxsize, timer=timer, stripes=stripes)
+        self._lock = threading.Lock()
+        self._bits: t.Dict[str, int] = {}
+        self._names: t.List[str] = []
+        self._masks: t.Dict[t.FrozenSet[str], int] = {}
+        self._scopes: t.Dict[int, t.FrozenSet[str]] = {}
+
+    def create(self,
+               subject: t.Any,
+               scopes: t.Iterable[str] = (),
+               ttl: t.Optional[float] = None) -> str:
+        """
+        Method to start a session.
+        :param subject:
+            A subject of the session, like "sub" of a token.
+            type: str
+        :param scopes:
+            A scopes granted to the session.
+            type: list
+        :param ttl:
+            Seconds the session lives, the ttl of the store by default.
+            type: float
+        :return:
+            The session id.
+        """
+        session_id = secrets.token_urlsafe(self.id_bytes)
+        if ttl is None:
+            ttl = self.ttl
+        self._sessions.set(session_id, Session(subject, self._register(scopes), self._timer() + ttl, ttl))
+        return session_id
+
+    def get(self, session_id: str) -> t.Optional[Session]:
+        """
+        Method to get a live session, sliding its expiry.
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+
+        now = self._timer()
+        if session.expires < now:
+            self._sessions.pop(session_id)
+            return None
+        if self.sliding:
+            session.expires = now + session.ttl
+        return session
+
+    def revoke(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id) is not None
+
+    def clear(self) -> None:
+        self._sessions.clear()
+
+    def mask(self, scopes: t.Iterable[str]) -> int:
+        """
+        Method to get the bits of scopes, unknown scopes have no bit.
+        """
+        key = frozenset(scopes)
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+
+        # a scope added between the computation and the store would be
+        # missing from the cached mask, both are done under the lock.
+        with self._lock:
+            mask = 0
+            for scope in key:
+                bit = self._bits.get(scope)
+                if bit is not None:
+                    mask |= 1 << bit
+            if len(self._masks) < 1024:
+                self._masks[key] = mask
+        return mask
+
+    def scopes(self, mask: int) -> t.FrozenSet[str]:
+        """
+        Method to get the scopes of bits.
+        """
+        scopes = self._scopes.get(mask)
+        if scopes is None:
+            scopes = frozenset(
+                name for bit, name in enumerate(self._names) if mask >> bit & 1
+            )
+            self._scopes[mask] = scopes
+        return scopes
+
+    def _register(self, scopes: t.Iterable[str]) -> int:
+        mask = 0
+        for scope in scopes:
+            bit = self._bits.get(scope)
+            if bit is None:
+                bit = self._add_scope(scope)
+            mask |= 1 << bit
+        return mask
+
+    def _add_scope(self, scope: str) -> int:
+        with self._lock:
+            bit = self._bits.get(scope)
+            if bit is None:
+                # names are only appended, readers do not lock.
+                self._names.append(scope)
+                bit = self._bits[scope] = len(self._names) - 1
+                # cached masks of unknown scopes are stale.
+                self._masks.clear()
+            return bit
+
+    def save(self, path: str) -> int:
+        """
+        Method to write a snapshot of the live sessions. The file is only
+        readable by its owner, as it holds the session ids.
+        :return:
+            The number of saved sessions.
+        """
+        now = self._timer()
+        sessions = [
+            [session_id, session.subject, session.mask, session.expires, session.ttl]
+            for session_id, _, session in self._sessions.items()
+            if session.expires >= now
+        ]
+        data = json.dumps({"scopes": self._names, "sessions": sessions})
+
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return len(sessions)
+
+    def load(self, path: str) -> int:
+        """
+        Method to restore the sessions of a snapshot, expired ones are dropped.
+        :return:
+            The number of restored sessions.
+        """
+        with open(path) as f:
+            snapshot = json.load(f)
+
+        # bits of the snapshot to bits of this store.
+        bits = [self._register([name]) for name in snapshot["scopes"]]
+        now = self._timer()
+        count = 0
+        for session_id, subject, saved_mask, expires, *ttl in snapshot["sessions"]:
+            if expires < now:
+                continue
+            mask = 0
+            for bit, value in enumerate(bits):
+                if saved_mask >> bit & 1:
+                    mask |= value
+            # snapshots without the ttl of the sessions slide by the ttl of the store.
+            self._sessions.set(session_id, Session(subject, mask, expires, ttl[0] if ttl else self.ttl))
+            count += 1
+        return count
+
+    def __contains__(self, session_id: str) -> bool:
+        session = self._sessions.get(session_id)
+        return session is not None and session.expires >= self._timer()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
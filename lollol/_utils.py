@@ -1,11 +1,18 @@
 import types
+import asyncio
+import contextvars
 import functools
 import inspect
+import operator
+import weakref
 import typing as t
 
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import params
 from fastapi import (
     FastAPI,
+    Security,
     APIRouter,
     Request,
     HTTPException,
@@ -15,12 +22,17 @@ from fastapi.security import SecurityScopes
 from fastapi.encoders import DictIntStrAny, SetIntStr
 from fastapi.datastructures import Default
 from fastapi.types import DecoratedCallable
+from starlette.concurrency import run_in_threadpool
 from starlette.routing import BaseRoute
 from starlette.responses import JSONResponse, Response
 
 from ._authorize import lookup_permission_obj
-from ._authorize import PermissionManager
+from ._authorize import VerifiedToken
+from ._authorize import _VERIFIED_TOKEN_ATTR
+from ._cache import ResponseCache
 from ._exceptions import ScopeNotSpecified
+from ._policy import Policy
+from ._policy import compile_policy
 
 _REQUEST_VAR_NAME   = "request"
 _X_REQUEST_VAR_NAME = "x_request"
@@ -121,11 +133,14 @@ def _get_code_from_function(
         else:
             arg_names += (request.name,)                          # type: ignore
         pos_count += diff_size
+
+    # appended names are locals too, the frame must reserve slots for them.
+    nlocals = _code.co_nlocals + len(arg_names) - len(_code.co_varnames)
     return types.CodeType(
                           pos_count,
                           _code.co_posonlyargcount,
                           _code.co_kwonlyargcount,
-                          _code.co_nlocals,
+                          nlocals,
                           _code.co_stacksize,
                           _code.co_flags,
                           _code.co_code,
@@ -139,8 +154,226 @@ def _get_code_from_function(
             )
 
 
+async def _authorize_request(
+        request: Request,
+        required_scopes: SecurityScopes,
+        policy: t.Optional[Policy] = None,
+        all_scopes: t.Sequence[str] = ()
+) -> VerifiedToken:
+    """
+    Function to verify the token of the request with the registered
+    permission manager, and attach it to the request state.
+    With a policy and no scopes, the policy alone decides. The token must
+    also have every scope of all_scopes.
+
+    :raise:
+        HTTPException(401) if the token does not have the required scopes
+        or the policy does not allow the request.
+    """
+    manager = lookup_permission_obj()
+    try:
+        access_token = await manager.get_token(request)
+    except Exception:
+        # requests without a token are denied by the login manager.
+        if manager.audit is not None:
+            await manager.audit.record(False, request, None, required_scopes.scopes)
+        raise
+
+    # extra secret key
+    extra_secret_key = request.headers.get(_EXTRA_SECRET_KEY)
+    verified_token = await manager.verify_async(
+                            token=access_token,
+                            required_scopes=required_scopes
+                            if policy is None or required_scopes.scopes else None,
+                            extra_secret_key=extra_secret_key
+                        )
+    if verified_token is not None and policy is not None \
+            and not policy.allows(verified_token, request):
+        verified_token = None
+    if verified_token is not None and all_scopes \
+            and not verified_token.scopes.issuperset(all_scopes):
+        verified_token = None
+    audit = manager.audit
+    if audit is not None:
+        subject = None if verified_token is None else verified_token.subject
+        await audit.record(verified_token is not None, request, subject, required_scopes.scopes)
+
+    if verified_token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="does not have authorization.")
+    setattr(request.state, _VERIFIED_TOKEN_ATTR, verified_token)
+    return verified_token
+
+
+def authorize_scopes(scopes: t.Sequence[str]) -> t.Any:
+    """
+    Function to create a FastAPI Security dependency which verifies the token
+    and returns the VerifiedToken. The endpoint signature is not modified.
+
+    The dependencies of a scope set share one checker, so FastAPI verifies
+    the token once per request and scope set with its dependency cache.
+    Any of the scopes is required, like the other protections, and every
+    scope of the enclosing Security dependencies is required too, so
+    nesting only narrows the access.
+
+    :param scopes:
+        A scopes specified by developer according to policies.
+        type: list
+    :return:
+        fastapi.params.Security
+    """
+    scopes = list(scopes)
+    return Security(_get_checker(SecurityScopes(scopes)).security, scopes=scopes)
+
+
+class _ScopeChecker:
+
+    """
+    Authorization check of a scope set and policy. Checkers are interned, so
+    all the routes with the same scope set and policy share one immutable
+    checker.
+    """
+
+    __slots__ = ("scopes", "policy", "parameter", "__weakref__")
+
+    scopes: SecurityScopes
+    policy: t.Optional[Policy]
+    parameter: inspect.Parameter
+
+    def __init__(self,
+                 scopes: SecurityScopes,
+                 policy: t.Optional[Policy] = None):
+        set_attr = super().__setattr__
+        set_attr("scopes", scopes)
+        set_attr("policy", policy)
+        # scopes parameter of the endpoint signature in router mode. FastAPI
+        # injects SecurityScopes parameters, it creates no query field per route.
+        set_attr("parameter", inspect.Parameter(
+            _SCOPE_VAR_NAME, POSITIONAL_OR_KEYWORD, default=scopes, annotation=SecurityScopes
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    async def __call__(self, request: Request) -> VerifiedToken:
+        return await _authorize_request(request, self.scopes, self.policy)
+
+    async def security(self, request: Request, security_scopes: SecurityScopes) -> VerifiedToken:
+        # FastAPI puts the scopes of the enclosing dependencies before ours.
+        inherited = security_scopes.scopes[:len(security_scopes.scopes) - len(self.scopes.scopes)]
+        return await _authorize_request(request, self.scopes, self.policy, inherited)
+
+
+_checkers: "weakref.WeakValueDictionary[t.Tuple[t.FrozenSet[str], t.Any], _ScopeChecker]" = \
+    weakref.WeakValueDictionary()
+
+
+def _get_checker(
+        scopes: SecurityScopes,
+        policy: t.Optional[Policy] = None
+) -> _ScopeChecker:
+    """
+    Function to get the interned checker of the scope set and policy.
+    """
+    key = (frozenset(scopes.scopes), policy)
+    checker = _checkers.get(key)
+    if checker is None:
+        checker = _checkers.setdefault(key, _ScopeChecker(scopes, policy))
+    return checker
+
+
+class _Route:
+
+    """
+    State of a protected endpoint, its wrapper only closes over this object.
+    """
+
+    __slots__ = ("endpoint", "checker", "request_var_name", "keep_request", "is_coroutine", "cache")
+
+    def __init__(self,
+                 endpoint: t.Callable,
+                 checker: _ScopeChecker,
+                 request_var_name: str,
+                 keep_request: bool,
+                 is_coroutine: bool,
+                 cache: t.Optional[ResponseCache]):
+        self.endpoint = endpoint
+        self.checker = checker
+        self.request_var_name = request_var_name
+        self.keep_request = keep_request
+        self.is_coroutine = is_coroutine
+        self.cache = cache
+
+
+_endpoint_executor: t.Optional[ThreadPoolExecutor] = None
+
+
+def set_threadpool_size(size: t.Optional[int]) -> None:
+    """
+    Function to set the number of threads which run the synchronous endpoints
+    protected by lollol. By default they run in the threadpool of starlette,
+    as FastAPI runs them. The previous pool finishes the calls already
+    submitted to it, the next calls run in the new pool.
+    :param size:
+        A number of threads, None to use the threadpool of starlette.
+        type: int
+    :return:
+        None
+    """
+    global _endpoint_executor
+
+    executor = None if size is None else ThreadPoolExecutor(size, thread_name_prefix="lollol")
+    previous, _endpoint_executor = _endpoint_executor, executor
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+async def _run_in_threadpool(func: t.Callable, *args: t.Any, **kwargs: t.Any) -> t.Any:
+    # run in the same context like starlette
+    child = functools.partial(func, *args, **kwargs)
+    context = contextvars.copy_context()
+    while True:
+        executor = _endpoint_executor
+        if executor is None:
+            return await run_in_threadpool(func, *args, **kwargs)
+        try:
+            future = executor.submit(context.run, child)
+        except RuntimeError:
+            # the pool was replaced and shut down by another thread after
+            # it was read, the call is submitted to the new pool.
+            if executor is _endpoint_executor:
+                raise
+            continue
+        return await asyncio.wrap_future(future)
+
+
+async def _call_endpoint(endpoint: t.Callable, is_coroutine: bool, *args: t.Any, **kwargs: t.Any) -> t.Any:
+    if is_coroutine:
+        return await endpoint(*args, **kwargs)
+    return await _run_in_threadpool(endpoint, *args, **kwargs)
+
+
+def _response_key(endpoint: t.Callable, request: Request, verified_token: VerifiedToken) -> t.Hashable:
+    # the order of the repeated query parameters is kept, they are lists.
+    query = sorted(request.query_params.multi_items(), key=operator.itemgetter(0))
+    return (
+        endpoint,
+        tuple(sorted(request.path_params.items())),
+        tuple(query),
+        frozenset(verified_token.scopes)
+    )
+
+
+def _is_cacheable(result: t.Any) -> bool:
+    # responses may be streamed or carry cookies, they are not reused.
+    return not isinstance(result, Response)
+
+
 def _authorize_required(
-        endpoint, scopes: t.Optional[SecurityScopes] = None
+        endpoint,
+        scopes: t.Optional[SecurityScopes] = None,
+        policy: t.Union[str, Policy, None] = None,
+        cache: t.Optional[ResponseCache] = None
 ) -> t.Callable:
 
     parameters = []
@@ -168,14 +401,21 @@ def _authorize_required(
                                                         params=sig_parameter
                                                 )
 
+    # policies are compiled once, at decoration time.
+    if isinstance(policy, str):
+        policy = compile_policy(policy)
+
+    declares_scope = scope is not None
     if not scope:
-        if scopes is None:
+        if scopes is None and policy is None:
             raise ScopeNotSpecified("scope must be present.")
 
-        # get scope when authorization unit is router or app.
-        scope = inspect.Parameter(
-            "scopes", POSITIONAL_OR_KEYWORD, default=scopes, annotation=inspect._empty   # type: ignore
-        )
+        # get scope when authorization unit is router or app,
+        # a policy alone does not require scopes.
+        checker = _get_checker(scopes or SecurityScopes([]), policy=policy)
+        scope = checker.parameter
+    else:
+        checker = _get_checker(scope.default, policy=policy)
 
     # scopes name must be _SCOPE_VAR_NAME
     if scope.name != _SCOPE_VAR_NAME:
@@ -237,50 +477,67 @@ def _authorize_required(
     endpoint.__signature__ = new_sig
     annotations[request_var_name] = Request
 
-    modified = types.FunctionType(
-        _get_code_from_function(
-            endpoint, len(parameters), request=request, scope=scope
-        ),
-        endpoint.__globals__
+    # the endpoint takes the request back when it declares it or when the
+    # scopes parameter is added, as the authorization unit is router or app.
+    keep_request = bool(scopes) or not declares_scope or \
+        _find_name(endpoint.__code__.co_varnames, request_var_name)
+    # synchronous endpoints run in the threadpool, not on the event loop.
+    is_coroutine = asyncio.iscoroutinefunction(endpoint)
+    endpoint.__code__ = _get_code_from_function(
+        endpoint, len(parameters), request=request, scope=scope
     )
-    _code = endpoint.__code__
-    org_argnames = _code.co_varnames
-    endpoint.__code__ = modified.__code__
+
+    route = _Route(endpoint, checker, request_var_name, keep_request, is_coroutine, cache)
 
     @functools.wraps(endpoint)
     async def decorator(*args, **kwargs):
-        request_obj: Request = kwargs.pop(request_var_name, None)
-        extra_secret_key = None
-
-        if not scopes and _find_name(org_argnames, request_var_name):
-            kwargs[request_var_name] = request_obj
-        elif scopes:
-            kwargs[request_var_name] = request_obj
-        required_scope = kwargs.get(_SCOPE_VAR_NAME, None)
-
-        manager: PermissionManager = lookup_permission_obj()
-        access_token = await manager.get_token(request_obj)
-        headers = request_obj.headers
-
-        # extra secret key
-        if _EXTRA_SECRET_KEY in headers:
-            extra_secret_key = headers.get(_EXTRA_SECRET_KEY)
-        have_permission = manager.has_permission(
-                                token=access_token,
-                                required_scopes=required_scope,
-                                extra_secret_key=extra_secret_key
-                            )
-        if not have_permission:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                detail="does not have authorization.")
-        response = await endpoint(*args, **kwargs)
-        return response
+        request_obj: Request
+        if route.keep_request:
+            request_obj = kwargs[route.request_var_name]
+        else:
+            request_obj = kwargs.pop(route.request_var_name, None)
+
+        verified_token = await route.checker(request_obj)
+        cache = route.cache
+        if cache is not None and request_obj.method == "GET":
+            return await cache.get_or_load(
+                _response_key(route.endpoint, request_obj, verified_token),
+                functools.partial(_call_endpoint, route.endpoint, route.is_coroutine, *args, **kwargs),
+                _is_cacheable
+            )
+        if route.is_coroutine:
+            return await route.endpoint(*args, **kwargs)
+        return await _run_in_threadpool(route.endpoint, *args, **kwargs)
     return decorator
 
 
-authorize_required = functools.partial(
-                        _authorize_required, scopes=None
-                    )
+def authorize_required(
+        endpoint: t.Optional[t.Callable] = None,
+        *,
+        policy: t.Union[str, Policy, None] = None,
+        cache: t.Optional[ResponseCache] = None
+) -> t.Callable:
+    """
+    Decorator to protect an endpoint with the scopes of its SecurityScopes
+    parameter and an optional policy, such as
+
+        @authorize_required(policy="claim.tenant == path.tenant_id and claim.mfa")
+
+    :param endpoint:
+        The endpoint, when used without arguments.
+        type: function
+    :param policy:
+        A policy which must allow the request.
+        type: str
+    :param cache:
+        A cache of the results of GET requests, served after the check.
+        type: ResponseCache
+    :return:
+        The protected endpoint, or a decorator when endpoint is None.
+    """
+    if endpoint is None:
+        return functools.partial(_authorize_required, scopes=None, policy=policy, cache=cache)
+    return _authorize_required(endpoint, None, policy, cache)
 
 
 def _get_router(obj):
@@ -295,7 +552,12 @@ def _get_router(obj):
         return router
 
 
-def authorize_router(router: APIRouter, scopes: SecurityScopes) -> APIRouter:
+def authorize_router(
+        router: APIRouter,
+        scopes: t.Optional[SecurityScopes],
+        policy: t.Union[str, Policy, None] = None,
+        cache: t.Optional[ResponseCache] = None
+) -> APIRouter:
 
     def api_route(
             path: str,
@@ -328,7 +590,7 @@ def authorize_router(router: APIRouter, scopes: SecurityScopes) -> APIRouter:
 
         def decorator(func: DecoratedCallable) -> t.Callable:
 
-            endpoint = _authorize_required(func, scopes)
+            endpoint = _authorize_required(func, scopes, policy, cache)
             router.add_api_route(
                 path,
                 endpoint,
@@ -364,6 +626,11 @@ def authorize_router(router: APIRouter, scopes: SecurityScopes) -> APIRouter:
     return router
 
 
-def authorize_app(app: FastAPI, scopes: SecurityScopes) -> FastAPI:
-    authorize_router(_get_router(app), scopes)
+def authorize_app(
+        app: FastAPI,
+        scopes: t.Optional[SecurityScopes],
+        policy: t.Union[str, Policy, None] = None,
+        cache: t.Optional[ResponseCache] = None
+) -> FastAPI:
+    authorize_router(_get_router(app), scopes, policy, cache)
     return app
@@ -0,0 +1,212 @@
+"""Verify tokens offline against current and past secrets.
+
+Tokens are read from files or stdin, one per line. A line may be a bare
+token or a log line which contains one, such as "Authorization: Bearer <token>".
+Tokens are verified in batches in a pool of processes, and a verdict is
+written as a JSON line per input line, in the order of the input:
+
+    python -m lollol.verify --secret CURRENT --secret PREVIOUS \\
+        --allowed-scopes user:read,user:write access.log > verdicts.jsonl
+
+Verdicts:
+    valid           signed with one of the secrets and not expired
+    expired         signed with one of the secrets but expired
+    over_scoped     valid, but grants scopes which are not allowed
+    invalid_claims  signed with one of the secrets, but not yet valid, for
+                    an audience, or with time claims which are not numbers
+    forged          not signed with any of the secrets
+    malformed       not a valid json web token
+    no_token        the line does not contain a token
+
+"secret" is the index of the matching secret, 0 is the first --secret.
+Tokens are not written, "digest" is the start of their SHA-256 to correlate.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import typing as t
+
+from concurrent.futures import ProcessPoolExecutor
+from jwt.exceptions import (
+    ExpiredSignatureError,
+    InvalidAlgorithmError,
+    InvalidSignatureError,
+    PyJWTError,
+)
+
+from ._claims import compile_scope_extractor
+from ._jwt import HMACVerifier
+from ._pool import chunked
+from ._pool import imap_bounded
+
+
+_BEARER_PATTERN = re.compile(r"Bearer\s+(\S+)")
+# encoded json headers start with '{"'
+_JWT_PATTERN = re.compile(r"eyJ[A-Za-z0-9_-]*\.[A-Za-z0-9_-]*\.[A-Za-z0-9_-]*")
+
+Line = t.Tuple[int, str]
+
+
+def _find_token(line: str) -> t.Optional[str]:
+    match = _BEARER_PATTERN.search(line)
+    if match is not None:
+        return match.group(1)
+
+    line = line.strip()
+    if line and len(line.split()) == 1:
+        return line
+    match = _JWT_PATTERN.search(line)
+    return None if match is None else match.group()
+
+
+class TokenAuditor:
+
+    """
+    Verifier of tokens against several secrets which tells why a token is
+    not valid. Tokens are decoded like `PermissionManager` does with
+    `HMACVerifier`.
+    """
+
+    def __init__(self,
+                 secrets: t.Sequence[str],
+                 algorithm: str = "HS256",
+                 perm_key: str = "scopes",
+                 allowed_scopes: t.Optional[t.Iterable[str]] = None,
+                 leeway: float = 0):
+        self.secrets = list(secrets)
+        self.algorithms = [algorithm]
+        self.perm_key = perm_key
+        self.allowed_scopes = None if allowed_scopes is None else frozenset(allowed_scopes)
+        self._verifier = HMACVerifier(leeway=leeway, maxkeys=max(1, len(self.secrets)))
+        self._scopes_of = compile_scope_extractor(perm_key)
+
+    def verdict(self, number: int, line: str) -> t.Dict[str, t.Any]:
+        """
+        Method to verify the token of a line.
+        :return:
+            The verdict of the line.
+        """
+        token = _find_token(line)
+        if token is None:
+            return {"line": number, "verdict": "no_token"}
+
+        result: t.Dict[str, t.Any] = {
+            "line": number,
+            "digest": hashlib.sha256(token.encode()).hexdigest()[:16],
+            "verdict": "forged",
+        }
+        for index, secret in enumerate(self.secrets):
+            try:
+                payload = self._verifier._decode_signed(token, secret, self.algorithms)
+            except (InvalidSignatureError, InvalidAlgorithmError):
+                continue
+            except (PyJWTError, TypeError):
+                result["verdict"] = "malformed"
+                return result
+
+            # the signature is good, the claims tell why the token is not valid.
+            try:
+                self._verifier._validate_claims(payload)
+            except ExpiredSignatureError:
+                result.update(verdict="expired", secret=index)
+                return result
+            except PyJWTError as e:
+                result.update(verdict="invalid_claims", secret=index, reason=str(e))
+                return result
+
+            scopes = sorted(scope for scope in self._scopes_of(payload) if isinstance(scope, str))
+            result.update(verdict="valid", secret=index, sub=payload.get("sub"), scopes=scopes)
+            if self.allowed_scopes is not None:
+                extra = sorted(set(scopes) - self.allowed_scopes)
+                if extra:
+                    result.update(verdict="over_scoped", extra_scopes=extra)
+            return result
+        return result
+
+    def verdicts(self, lines: t.List[Line]) -> t.List[str]:
+        return [json.dumps(self.verdict(number, line)) for number, line in lines]
+
+
+_worker_auditor: t.Optional[TokenAuditor] = None
+
+
+def _init_worker(auditor: TokenAuditor) -> None:
+    global _worker_auditor
+    _worker_auditor = auditor
+
+
+def _verdicts_in_worker(lines: t.List[Line]) -> t.List[str]:
+    return _worker_auditor.verdicts(lines)                        # type: ignore
+
+
+def _read_lines(paths: t.Sequence[str]) -> t.Iterator[Line]:
+    number = 0
+    for path in paths or ["-"]:
+        stream = sys.stdin if path == "-" else open(path)
+        try:
+            for line in stream:
+                number += 1
+                yield number, line
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def verify_lines(auditor: TokenAuditor,
+                 lines: t.Iterable[Line],
+                 processes: int = 1,
+                 chunksize: int = 1000) -> t.Iterator[str]:
+    """
+    Function to verify lines in batches. At most two batches per process
+    are in flight, so the memory does not depend on the size of the input.
+    :return:
+        Iterator of the verdicts as JSON, in the order of the lines.
+    """
+    batches = chunked(lines, chunksize)
+    if processes <= 1:
+        for batch in batches:
+            yield from auditor.verdicts(batch)
+        return
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(auditor,)) as executor:
+        for verdicts in imap_bounded(executor, _verdicts_in_worker, batches, processes * 2):
+            yield from verdicts
+
+
+def main(argv: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m lollol.verify",
+        description=__doc__.splitlines()[0],                       # type: ignore
+    )
+    parser.add_argument("files", nargs="*", help="files of tokens, stdin by default")
+    parser.add_argument("--secret", action="append", required=True,
+                        help="secret key, repeat for past secrets")
+    parser.add_argument("--algorithm", default="HS256")
+    parser.add_argument("--perm-key", default="scopes")
+    parser.add_argument("--allowed-scopes", action="append",
+                        help="comma separated scopes a token may grant, others are "
+                             "over-scoped, may be repeated")
+    parser.add_argument("--leeway", type=float, default=0)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunksize", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    allowed_scopes = None
+    if args.allowed_scopes is not None:
+        allowed_scopes = [
+            scope for value in args.allowed_scopes for scope in value.split(",") if scope
+        ]
+    auditor = TokenAuditor(args.secret, args.algorithm, args.perm_key,
+                           allowed_scopes, args.leeway)
+    write = sys.stdout.write
+    for verdict in verify_lines(auditor, _read_lines(args.files), args.processes, args.chunksize):
+        write(verdict + "\n")
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,3 +5,17 @@ from lollol import authorize_required
 from lollol import authorize_router
 from lollol import authorize_app
 from lollol._exceptions import ScopeNotSpecified
+from lollol import get_verified_token
+from lollol import VerifiedToken
+from lollol import UserCache
+from lollol import HMACVerifier
+from lollol import authorize_scopes
+from lollol import set_threadpool_size
+from lollol import IntrospectionVerifier
+from lollol import AuditLog
+from lollol import Policy
+from lollol import compile_policy
+from lollol._exceptions import PolicySyntaxError
+from lollol import SessionStore
+from lollol import TokenCache
+from lollol import ResponseCache
@@ -0,0 +1,161 @@
+import asyncio
+import gc
+import os
+import tracemalloc
+
+import pytest
+
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.security import SecurityScopes
+from starlette.requests import Request
+
+import lollol
+
+from . import authorize_required
+from . import authorize_router
+from . import authorize_app
+from . import PermissionManager
+from . import LoginManager
+from . import lookup_permission_obj
+from lollol._authorize import _pemission_local
+
+
+REQUESTS = 200
+LOLLOL_FILES = os.path.join(os.path.dirname(lollol.__file__), "*")
+
+# Bytes allocated at the peak of one protected request, over an unprotected
+# endpoint, and of PermissionManager.has_permission, which decodes the token.
+# Blocks allocated by lollol must not be retained between requests, a few
+# are held by the traceback of the last denial.
+# Raise a budget only with the reason in the commit.
+PEAK_BUDGET = {
+    "allowed": 3400,
+    "denied": 3300,
+}
+HAS_PERMISSION_PEAK_BUDGET = 2560
+RETAINED_BLOCKS_BUDGET = 32
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+allowed_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+denied_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:delete"])
+)
+
+
+@authorize_required
+async def decorated(scopes=SecurityScopes(["user:read"])):
+    return {}
+
+
+router = authorize_router(APIRouter(), SecurityScopes(["user:read"]))
+
+
+@router.get("/foo")
+async def routed():
+    return {}
+
+
+app = authorize_app(FastAPI(), SecurityScopes(["user:read"]))
+
+
+@app.get("/foo")
+async def applied():
+    return {}
+
+
+async def unprotected(request, scopes):
+    return {}
+
+
+ENDPOINTS = {"decorator": decorated, "router": routed, "app": applied}
+TOKENS = {"allowed": allowed_token, "denied": denied_token}
+
+
+@pytest.fixture(autouse=True)
+def permission_manager():
+    PermissionManager(manager)
+    yield
+    _pemission_local.pop()
+
+
+def make_request(headers):
+    return Request({
+        "type": "http", "method": "GET", "path": "/foo", "query_string": b"", "headers": headers,
+    })
+
+
+async def call(endpoint, request):
+    try:
+        await endpoint(request=request, scopes=SecurityScopes(["user:read"]))
+    except HTTPException:
+        pass
+
+
+def measure(func, *args):
+    """
+    Function to measure the median peak bytes of func(*args) and the number
+    of blocks allocated by lollol which are retained after REQUESTS calls.
+    """
+    # warm up caches, interned objects and the event loop.
+    for _ in range(10):
+        func(*args)
+
+    # tracing starts with a peak of zero, tracemalloc.reset_peak is 3.9+.
+    peaks = []
+    for _ in range(REQUESTS):
+        tracemalloc.start(1)
+        try:
+            func(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    gc.collect()
+    tracemalloc.start(1)
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(REQUESTS):
+            func(*args)
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    lollol_only = [tracemalloc.Filter(True, LOLLOL_FILES)]
+    retained = after.filter_traces(lollol_only).compare_to(
+        before.filter_traces(lollol_only), "lineno"
+    )
+    return sorted(peaks)[len(peaks) // 2], sum(max(0, stat.count_diff) for stat in retained)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.mark.parametrize("mode", sorted(ENDPOINTS))
+@pytest.mark.parametrize("outcome", sorted(TOKENS))
+def test_request_allocation_budget(loop, mode, outcome):
+    headers = [(b"authorization", ("Bearer %s" % TOKENS[outcome]).encode())]
+
+    def request(endpoint):
+        # the baseline subtracts the request and the event loop.
+        loop.run_until_complete(call(endpoint, make_request(headers)))
+
+    baseline, _ = measure(request, unprotected)
+    peak, retained_blocks = measure(request, ENDPOINTS[mode])
+    assert peak - baseline <= PEAK_BUDGET[outcome], (mode, outcome, peak - baseline)
+    assert retained_blocks <= RETAINED_BLOCKS_BUDGET, (mode, outcome, retained_blocks)
+
+
+@pytest.mark.parametrize("outcome", sorted(TOKENS))
+def test_has_permission_allocation_budget(outcome):
+    peak, retained_blocks = measure(
+        lookup_permission_obj().has_permission, TOKENS[outcome], SecurityScopes(["user:read"])
+    )
+    assert peak <= HAS_PERMISSION_PEAK_BUDGET, (outcome, peak)
+    assert retained_blocks <= RETAINED_BLOCKS_BUDGET, (outcome, retained_blocks)
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from fastapi import FastAPI, status
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from . import authorize_required
+from . import PermissionManager
+from . import LoginManager
+from . import AuditLog
+from lollol._authorize import _pemission_local
+
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+access_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+
+app = FastAPI()
+client = TestClient(app)
+
+
+@app.get("/foo")
+@authorize_required
+async def foo(scopes=SecurityScopes(["user:read"])):
+    return {}
+
+
+@app.get("/lol")
+@authorize_required
+async def lol(scopes=SecurityScopes(["user:write"])):
+    return {}
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def make_request():
+    return Request({"type": "http", "method": "GET", "path": "/foo",
+                    "query_string": b"", "headers": [], "client": ("127.0.0.1", 1)})
+
+
+@pytest.fixture
+def audit(tmp_path):
+    audit = AuditLog(str(tmp_path / "audit.log"), batch_size=2)
+    PermissionManager(manager, audit=audit)
+    yield audit
+    _pemission_local.pop()
+
+
+def test_decisions_are_logged(audit):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert client.get("/foo", headers=headers).status_code == 200
+    assert client.get("/lol", headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+    assert client.get("/foo", headers=headers).status_code == 200
+    run(audit.aclose())
+
+    lines = read_lines(audit.path)
+    assert [(line["allowed"], line["path"]) for line in lines] == \
+        [(True, "/foo"), (False, "/lol"), (True, "/foo")]
+    assert lines[0]["sub"] == "uram24@42maru.com"
+    assert lines[1]["sub"] is None
+    assert lines[1]["scopes"] == ["user:write"]
+    assert audit.written == 3
+
+
+def test_missing_token_is_logged(audit):
+    assert client.get("/foo").status_code == status.HTTP_401_UNAUTHORIZED
+    assert client.get("/foo", headers={"Authorization": "Bearer garbage"}).status_code == \
+        status.HTTP_401_UNAUTHORIZED
+    run(audit.aclose())
+
+    assert [(line["allowed"], line["sub"]) for line in read_lines(audit.path)] == \
+        [(False, None), (False, None)]
+
+
+def test_drop_policy(tmp_path):
+    audit = AuditLog(str(tmp_path / "audit.log"), maxsize=2)
+
+    async def burst():
+        # the drain task does not run before the burst yields.
+        for _ in range(5):
+            await audit.record(True, make_request(), "sunny", ["user:read"])
+        await audit.aclose()
+
+    run(burst())
+    assert audit.dropped == 3
+    assert len(read_lines(audit.path)) == 2
+
+
+def test_block_policy(tmp_path):
+    audit = AuditLog(str(tmp_path / "audit.log"), maxsize=2, policy="block")
+
+    async def burst():
+        for _ in range(5):
+            await audit.record(True, make_request(), "sunny", ["user:read"])
+        await audit.aclose()
+
+    run(burst())
+    assert audit.dropped == 0
+    assert len(read_lines(audit.path)) == 5
+
+
+def test_rotation(tmp_path):
+    path = str(tmp_path / "audit.log")
+    audit = AuditLog(path, max_bytes=300, backup_count=2)
+
+    async def burst():
+        for _ in range(10):
+            await audit.record(True, make_request(), "sunny", ["user:read"])
+            await asyncio.sleep(0.01)
+        await audit.aclose()
+
+    run(burst())
+    files = sorted(p.name for p in tmp_path.iterdir())
+    assert files == ["audit.log", "audit.log.1", "audit.log.2"]
+
+
+def test_subject_is_written_as_string(tmp_path):
+    audit = AuditLog(str(tmp_path / "audit.log"), maxsize=2, policy="block")
+    subject = uuid.uuid4()
+
+    async def burst():
+        for _ in range(5):
+            await audit.record(True, make_request(), subject, ["user:read"])
+        await asyncio.wait_for(audit.aclose(), 5)
+
+    run(burst())
+    assert [line["sub"] for line in read_lines(audit.path)] == [str(subject)] * 5
+
+
+@pytest.mark.parametrize("policy", ["block", "drop"])
+def test_write_errors_do_not_stop_draining(tmp_path, policy):
+    audit = AuditLog(str(tmp_path / "missing" / "audit.log"), maxsize=2, policy=policy)
+
+    async def burst():
+        for _ in range(5):
+            await audit.record(True, make_request(), "sunny", ["user:read"])
+        await asyncio.wait_for(audit.aclose(), 5)
+
+    run(burst())
+    assert audit.failed + audit.dropped == 5
+    assert audit.written == 0
@@ -0,0 +1,99 @@
+from fastapi import FastAPI, APIRouter, Depends, Security, status
+from fastapi.testclient import TestClient
+
+from . import PermissionManager
+from . import LoginManager
+from . import authorize_scopes
+from . import VerifiedToken
+
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+manager.app_name = "test"
+
+access_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+
+PermissionManager(manager)
+
+verifications = []
+
+
+def count_verification(token: VerifiedToken = authorize_scopes(["user:read"])):
+    verifications.append(token)
+    return token
+
+
+app = FastAPI()
+router = APIRouter(dependencies=[authorize_scopes(["user:delete"])])
+
+
+@app.get("/foo")
+async def foo(token: VerifiedToken = authorize_scopes(["user:read"])):
+    return {"sub": token.subject}
+
+
+@app.get("/bar")
+async def bar(first=Depends(count_verification), second=Depends(count_verification),
+              token: VerifiedToken = authorize_scopes(["user:read"])):
+    return {"same": first is second is token}
+
+
+@app.get("/lol")
+async def lol(token: VerifiedToken = authorize_scopes(["user:write"])):
+    return {"sub": token.subject}
+
+
+@router.get("/hug")
+async def hug():
+    return {"ok": True}
+
+
+app.include_router(router)
+client = TestClient(app)
+headers = {"Authorization": f"Bearer {access_token}"}
+
+
+def test_security_dependency():
+    response = client.get("/foo", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"sub": "uram24@42maru.com"}
+
+
+def test_security_dependency_is_cached_per_request():
+    verifications.clear()
+    response = client.get("/bar", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json() == {"same": True}
+    assert len(verifications) == 1
+
+
+def test_security_dependency_denied():
+    response = client.get("/lol", headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.text
+
+
+def test_security_dependency_on_router():
+    response = client.get("/hug", headers=headers)
+    assert response.status_code == 200, response.text
+    assert client.get("/hug").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def current_user(token: VerifiedToken = authorize_scopes(["user:read"])):
+    return token
+
+
+@app.get("/admin")
+async def admin(user: VerifiedToken = Security(current_user, scopes=["admin"])):
+    return {"sub": user.subject}
+
+
+def test_nested_security_narrows_access():
+    def get_admin(*scopes):
+        token = manager.create_access_token(data=dict(sub="sunny", scopes=list(scopes)))
+        return client.get("/admin", headers={"Authorization": f"Bearer {token}"}).status_code
+
+    assert get_admin("user:read") == status.HTTP_401_UNAUTHORIZED
+    assert get_admin("admin") == status.HTTP_401_UNAUTHORIZED
+    assert get_admin("user:read", "admin") == 200
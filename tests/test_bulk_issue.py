@@ -0,0 +1,64 @@
+import jwt
+import pytest
+
+from datetime import timedelta
+
+from . import LoginManager
+
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+
+
+def test_bulk_tokens_match_single_tokens():
+    claims = [dict(sub="user%d" % i, scopes=["user:read"]) for i in range(600)]
+    tokens = list(manager.create_access_tokens(claims, chunksize=100))
+
+    assert len(tokens) == 600
+    for data, token in zip(claims, tokens):
+        payload = jwt.decode(token, "test_secret", algorithms=["HS256"])
+        assert payload["sub"] == data["sub"]
+        assert payload["scopes"] == ["user:read"]
+        assert "exp" in payload
+
+
+def test_bulk_tokens_are_streamed():
+    def claims():
+        yield dict(sub="first")
+        raise RuntimeError("must not be consumed")
+
+    tokens = manager.create_access_tokens(claims(), chunksize=1)
+    assert jwt.decode(next(tokens), "test_secret", algorithms=["HS256"])["sub"] == "first"
+
+
+def test_bulk_tokens_with_scopes_and_expiry():
+    token, = manager.create_access_tokens(
+        [dict(sub="a")], expires=timedelta(seconds=-10), scopes=["x", "x"]
+    )
+    with pytest.raises(jwt.ExpiredSignatureError):
+        jwt.decode(token, "test_secret", algorithms=["HS256"])
+
+    payload = jwt.decode(token, "test_secret", algorithms=["HS256"], options={"verify_exp": False})
+    assert payload["scopes"] == ["x"]
+
+
+def test_bulk_tokens_in_process_pool():
+    rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+    serialization = pytest.importorskip("cryptography.hazmat.primitives.serialization")
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+    rs_manager = LoginManager(private_pem, '/auth', algorithm="RS256")
+    claims = [dict(sub="user%d" % i) for i in range(20)]
+    tokens = list(rs_manager.create_access_tokens(claims, processes=2, chunksize=3))
+
+    assert [jwt.decode(token, public_pem, algorithms=["RS256"])["sub"] for token in tokens] == \
+        [data["sub"] for data in claims]
@@ -0,0 +1,89 @@
+import pytest
+
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from . import TokenCache
+from lollol._authorize import _pemission_local
+from lollol._claims import compile_scope_extractor
+
+
+payload = {
+    "sub": "uram24@42maru.com",
+    "scope": "user:read user:write",
+    "realm_access": {"roles": ["admin", "viewer"]},
+    "resource_access": {"api.example.com": {"roles": ["user:delete"]}},
+    "scopes": ["user:read"],
+}
+
+
+def test_top_level_claim():
+    assert compile_scope_extractor()(payload) == ["user:read"]
+    assert compile_scope_extractor("scope")(payload) == ["user:read", "user:write"]
+    assert compile_scope_extractor("missing")(payload) == ()
+
+
+def test_nested_claims():
+    extract = compile_scope_extractor(["scope", "realm_access.roles"])
+    assert extract(payload) == {"user:read", "user:write", "admin", "viewer"}
+
+    # a key with a dot is given as a tuple of keys.
+    extract = compile_scope_extractor([("resource_access", "api.example.com", "roles")])
+    assert extract(payload) == {"user:delete"}
+    assert compile_scope_extractor("realm_access.missing.roles")(payload) == frozenset()
+    assert compile_scope_extractor("sub.roles")(payload) == frozenset()
+
+
+def test_scope_map():
+    extract = compile_scope_extractor(
+        ["scopes", "realm_access.roles"],
+        {"realm_access.roles": {"admin": ["user:write", "user:delete"], "viewer": "user:read"}},
+    )
+    assert extract(payload) == {"user:read", "user:write", "user:delete"}
+
+    with pytest.raises(ValueError):
+        compile_scope_extractor("scopes", {"realm_access.roles": {"admin": "user:write"}})
+    with pytest.raises(ValueError):
+        compile_scope_extractor("realm_access..roles")
+    with pytest.raises(ValueError):
+        compile_scope_extractor([])
+
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+access_token = manager.create_access_token(data=payload)
+
+
+@pytest.fixture
+def permission_manager():
+    permission_manager = PermissionManager(
+        manager,
+        perm_key=["scope", "realm_access.roles"],
+        scope_map={"realm_access.roles": {"admin": ["user:delete"]}},
+        token_cache=TokenCache(),
+    )
+    yield permission_manager
+    _pemission_local.pop()
+
+
+def test_permission_of_nested_claims(permission_manager):
+    assert permission_manager.has_permission(access_token, SecurityScopes(["user:delete"]))
+    assert permission_manager.has_permission(access_token, SecurityScopes(["viewer"]))
+    assert not permission_manager.has_permission(access_token, SecurityScopes(["admin:write"]))
+
+    verified = permission_manager.verify(access_token, SecurityScopes(["user:write"]))
+    assert verified.scopes == {"user:read", "user:write", "user:delete", "viewer"}
+
+
+def test_scopes_are_cached_with_token(permission_manager, monkeypatch):
+    calls = []
+    extract = permission_manager._scopes_of
+
+    def _scopes_of(payload):
+        calls.append(payload["sub"])
+        return extract(payload)
+
+    monkeypatch.setattr(permission_manager, "_scopes_of", _scopes_of)
+    for _ in range(3):
+        assert permission_manager.has_permission(access_token, SecurityScopes(["user:delete"]))
+    assert calls == ["uram24@42maru.com"]
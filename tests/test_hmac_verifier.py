@@ -0,0 +1,135 @@
+import base64
+import json
+import time
+
+import jwt
+import pytest
+
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from . import HMACVerifier
+from lollol._authorize import _pemission_local
+
+
+secret = "test_secret"
+now = int(time.time())
+
+
+def b64(data):
+    if not isinstance(data, bytes):
+        data = json.dumps(data).encode()
+    return base64.urlsafe_b64encode(data).replace(b"=", b"").decode()
+
+
+def encode(payload, key=secret, algorithm="HS256", headers=None):
+    return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+valid = encode({"sub": "sunny", "exp": now + 60, "scopes": ["user:read"]})
+header, payload, signature = valid.split(".")
+
+tokens = {
+    "valid": valid,
+    "no_exp": encode({"sub": "sunny"}),
+    "hs384": encode({"sub": "sunny"}, algorithm="HS384"),
+    "hs512": encode({"sub": "sunny"}, algorithm="HS512"),
+    "expired": encode({"sub": "sunny", "exp": now - 60}),
+    "exp_not_int": encode({"exp": "soon"}),
+    "nbf_future": encode({"nbf": now + 60}),
+    "nbf_past": encode({"nbf": now - 60}),
+    "nbf_not_int": encode({"nbf": "later"}),
+    "iat_not_int": encode({"iat": "now"}),
+    "iat_future": encode({"iat": now + 60}),
+    "aud": encode({"aud": "service"}),
+    "aud_empty": encode({"aud": ""}),
+    "wrong_secret": encode({"sub": "sunny"}, key="other"),
+    "alg_none": encode({"sub": "sunny"}, key=None, algorithm="none"),
+    "b64_false": encode({"sub": "sunny"}, headers={"b64": False}),
+    "not_enough_segments": header + "." + payload,
+    "header_padding": "a" + header + "." + payload + "." + signature,
+    "header_not_json": b64(b"nope") + "." + payload + "." + signature,
+    "header_not_object": b64([1]) + "." + payload + "." + signature,
+    "payload_padding": header + ".a" + payload + "." + signature,
+    "crypto_padding": header + "." + payload + ".a" + signature,
+    "tampered_payload": header + "." + b64({"sub": "admin"}) + "." + signature,
+    "payload_not_json": ".".join([header, b64(b"nope")]),
+    "payload_not_object": ".".join([header, b64([1, 2])]),
+    "empty": "",
+}
+
+
+def _sign(token):
+    # sign tokens with a crafted payload, so only the payload is invalid.
+    import hmac
+    import hashlib
+    mac = hmac.new(secret.encode(), token.encode(), hashlib.sha256).digest()
+    return token + "." + b64(mac)
+
+
+tokens["payload_not_json"] = _sign(tokens["payload_not_json"])
+tokens["payload_not_object"] = _sign(tokens["payload_not_object"])
+
+
+def outcome(decode, token, algorithms):
+    try:
+        return decode(token, secret, algorithms=algorithms)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize("name", sorted(tokens))
+@pytest.mark.parametrize("algorithms", [["HS256"], ["HS384", "HS512"]])
+def test_parity_with_pyjwt(name, algorithms):
+    verifier = HMACVerifier()
+    token = tokens[name]
+    expected = outcome(jwt.decode, token, algorithms)
+
+    assert outcome(verifier.decode, token, algorithms) == expected
+    # the second decoding uses the cached header and keyed hmac object.
+    assert outcome(verifier.decode, token, algorithms) == expected
+
+
+def test_parity_with_leeway():
+    verifier = HMACVerifier(leeway=120)
+    token = tokens["expired"]
+
+    assert verifier.decode(token, secret, ["HS256"]) == \
+        jwt.decode(token, secret, algorithms=["HS256"], leeway=120)
+
+
+def test_json_backend():
+    loads = []
+
+    def json_loads(data):
+        loads.append(data)
+        return json.loads(data)
+
+    HMACVerifier(json_loads=json_loads).decode(valid, secret, ["HS256"])
+    assert len(loads) == 1
+
+
+def test_keyed_objects_are_bounded():
+    verifier = HMACVerifier(maxkeys=2)
+    for n in range(5):
+        key = "%s%d" % (secret, n)
+        assert verifier.decode(encode({"sub": "sunny"}, key), key, ["HS256"]) == {"sub": "sunny"}
+
+    assert len(verifier._macs) == 2
+    assert verifier.decode(valid, secret, ["HS256"])["sub"] == "sunny"
+
+
+def test_permission_manager_with_verifier():
+    manager = LoginManager(secret, '/auth', use_header=True)
+    token = manager.create_access_token(data=dict(sub="sunny", scopes=["user:read"]))
+    extra_token = jwt.encode({"sub": "sunny", "scopes": ["user:read"]}, secret + "extra")
+
+    pm = PermissionManager(manager, verifier=HMACVerifier())
+    try:
+        assert pm.verify(token, SecurityScopes(["user:read"])).subject == "sunny"
+        assert pm.verify(token, SecurityScopes(["user:write"])) is None
+        assert pm.verify(extra_token, SecurityScopes(["user:read"])) is None
+        assert pm.verify(extra_token, SecurityScopes(["user:read"]), "extra") is not None
+    finally:
+        _pemission_local.pop()
@@ -0,0 +1,64 @@
+import subprocess
+import sys
+
+import pytest
+
+
+# cumulative microseconds of `import lollol` reported by -X importtime.
+IMPORT_BUDGET_US = 50000
+
+# cumulative microseconds of the module of a lazy attribute, with its
+# dependencies, reported by -X importtime.
+ATTRIBUTE_BUDGET_US = {
+    "HMACVerifier": ("lollol._jwt", 250000),
+    "PermissionManager": ("lollol._authorize", 500000),
+}
+
+WEB_PACKAGES = ("fastapi", "fastapi_login", "starlette", "pydantic", "passlib")
+
+
+def _run(code, *options):
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        check=True, capture_output=True, text=True
+    )
+
+
+def _import_times(code):
+    times = {}
+    for line in _run(code, "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time_budget():
+    times = _import_times("import lollol")
+    assert times["lollol"] < IMPORT_BUDGET_US, times["lollol"]
+
+
+@pytest.mark.parametrize("name", sorted(ATTRIBUTE_BUDGET_US))
+def test_attribute_import_time_budget(name):
+    module, budget = ATTRIBUTE_BUDGET_US[name]
+    elapsed = min(_import_times("import lollol; lollol.%s" % name)[module] for _ in range(3))
+    assert elapsed < budget, (module, elapsed)
+
+
+def test_verification_does_not_import_web_framework():
+    result = _run(
+        "import sys, lollol\n"
+        "lollol.HMACVerifier, lollol.TokenSigner\n"
+        "print(' '.join(sorted(sys.modules)))"
+    )
+    loaded = {name.split(".")[0] for name in result.stdout.split()}
+    assert loaded.isdisjoint(WEB_PACKAGES), loaded & set(WEB_PACKAGES)
+
+
+def test_lazy_attributes():
+    result = _run(
+        "import lollol\n"
+        "print(lollol.PermissionManager.__module__, 'authorize_app' in dir(lollol))"
+    )
+    assert result.stdout.split() == ["lollol._authorize", "True"]
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from . import IntrospectionVerifier
+from lollol._authorize import _pemission_local
+
+
+httpx = pytest.importorskip("httpx")
+
+
+class Introspection(BaseHTTPRequestHandler):
+
+    tokens = {}
+    requests = []
+    delay = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        token = parse_qs(body.decode())["token"][0]
+        self.requests.append(token)
+        time.sleep(self.delay)
+
+        data = json.dumps(self.tokens.get(token, {"active": False})).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Introspection)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d/introspect" % httpd.server_address[1]
+    httpd.shutdown()
+
+
+@pytest.fixture
+def introspection(server):
+    Introspection.requests = []
+    Introspection.delay = 0.0
+    Introspection.tokens = {
+        "opaque-read": {"active": True, "sub": "sunny", "scope": "user:read user:delete",
+                        "exp": int(time.time()) + 60},
+        "opaque-short": {"active": True, "sub": "sunny", "scope": "user:read",
+                         "exp": int(time.time()) + 1},
+    }
+    verifier = IntrospectionVerifier(server, "client", "secret", timeout=0.2,
+                                     failure_threshold=2, reset_timeout=60)
+    pm = PermissionManager(LoginManager("test_secret", '/auth'), verifier=verifier)
+    yield pm, verifier
+    _pemission_local.pop()
+    run(verifier.aclose())
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_active_token_is_cached(introspection):
+    pm, _ = introspection
+    token = run(pm.verify_async("opaque-read", SecurityScopes(["user:read"])))
+
+    assert token.subject == "sunny"
+    assert token.scopes == {"user:read", "user:delete"}
+    assert run(pm.verify_async("opaque-read", SecurityScopes(["user:write"]))) is None
+    assert Introspection.requests == ["opaque-read"]
+
+
+def test_inactive_token(introspection):
+    pm, _ = introspection
+    assert run(pm.verify_async("unknown", SecurityScopes(["user:read"]))) is None
+    assert run(pm.verify_async("unknown", SecurityScopes(["user:read"]))) is None
+    assert Introspection.requests == ["unknown"]
+
+
+def test_concurrent_lookups_are_coalesced(introspection):
+    pm, _ = introspection
+    Introspection.delay = 0.05
+
+    async def burst():
+        return await asyncio.gather(
+            *(pm.verify_async("opaque-read", SecurityScopes(["user:read"])) for _ in range(20))
+        )
+
+    assert all(run(burst()))
+    assert Introspection.requests == ["opaque-read"]
+
+
+def test_cache_is_bounded_by_exp(introspection):
+    pm, _ = introspection
+    run(pm.verify_async("opaque-short", SecurityScopes(["user:read"])))
+    time.sleep(1.1)
+    run(pm.verify_async("opaque-short", SecurityScopes(["user:read"])))
+
+    assert Introspection.requests == ["opaque-short", "opaque-short"]
+
+
+def test_malformed_exp_is_denied(introspection):
+    pm, _ = introspection
+    Introspection.tokens["opaque-exp"] = {"active": True, "sub": "sunny", "scope": "user:read",
+                                          "exp": "tomorrow"}
+
+    assert run(pm.verify_async("opaque-exp", SecurityScopes(["user:read"]))) is None
+
+
+def test_circuit_opens_on_slow_upstream(introspection):
+    pm, verifier = introspection
+    Introspection.delay = 0.5
+
+    for token in ("slow-1", "slow-2", "slow-3", "opaque-read"):
+        assert run(pm.verify_async(token, SecurityScopes(["user:read"]))) is None
+
+    assert verifier.breaker.state == "open"
+    assert Introspection.requests == ["slow-1", "slow-2"]
+
+
+def test_sync_verify_is_refused(introspection):
+    pm, _ = introspection
+    with pytest.raises(TypeError):
+        pm.verify("opaque-read", SecurityScopes(["user:read"]))
@@ -0,0 +1,208 @@
+import inspect
+
+import pytest
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from . import authorize_required
+from . import authorize_router
+from . import compile_policy
+from . import Policy
+from . import PolicySyntaxError
+from . import VerifiedToken
+
+TENANT_POLICY = "'orders:write' in scopes and claim.tenant == path.tenant_id and claim.mfa"
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+PermissionManager(manager)
+
+
+def _token(**claims):
+    claims.setdefault("sub", "uram24@42maru.com")
+    return manager.create_access_token(data=claims)
+
+
+def _headers(**claims):
+    return {"Authorization": "Bearer %s" % _token(**claims)}
+
+
+router = APIRouter()
+
+
+@router.get("/tenants/{tenant_id}/orders")
+@authorize_required(policy=TENANT_POLICY)
+async def orders(tenant_id: str):
+    return {"tenant": tenant_id}
+
+
+@router.get("/reports")
+@authorize_required(policy="query.region in claim.regions or 'admin' in scopes")
+async def reports(region: str = "eu", scopes=SecurityScopes(["report:read"])):
+    return {"region": region}
+
+
+policy_router = authorize_router(APIRouter(), None, policy="claim.level >= 1 or claim.staff")
+scoped_router = authorize_router(APIRouter(), SecurityScopes(["item:read"]),
+                                 policy="not claim.suspended")
+
+
+@scoped_router.get("/items")
+async def items():
+    return {}
+
+
+app = FastAPI()
+app.include_router(router)
+app.include_router(scoped_router)
+client = TestClient(app)
+
+
+class _Request:
+
+    def __init__(self, path_params=None, query_params=None):
+        self.path_params = path_params or {}
+        self.query_params = query_params or {}
+
+
+def _verified(**claims):
+    return VerifiedToken("token-%r" % sorted(claims.items()), claims, claims.get("scopes", []))
+
+
+@pytest.mark.parametrize("source, claims, request_params, expected", [
+    ("claim.mfa", {"mfa": True}, {}, True),
+    ("claim.mfa", {}, {}, False),
+    ("not claim.mfa", {"mfa": False}, {}, True),
+    ("claim.org.id == 7", {"org": {"id": 7}}, {}, True),
+    ("claim.org.id == '7'", {"org": {"id": 7}}, {}, True),
+    ("claim.org.id != 7", {"org": None}, {}, True),
+    ("claim.tenant == path.tenant_id", {"tenant": 42}, {"path_params": {"tenant_id": "42"}}, True),
+    ("claim.tenant == path.tenant_id", {"tenant": 42}, {"path_params": {"tenant_id": "43"}}, False),
+    ("query.region in claim.regions", {"regions": ["eu"]}, {"query_params": {"region": "eu"}}, True),
+    ("query.region not in claim.regions", {"regions": ["eu"]}, {"query_params": {"region": "us"}}, True),
+    ("query.region in claim.regions", {}, {"query_params": {"region": "eu"}}, False),
+    ("'a' in scopes and ('b' in scopes or claim.staff == true)", {"scopes": ["a"], "staff": True}, {}, True),
+    ("'a' in scopes and ('b' in scopes or claim.staff == true)", {"scopes": ["b"], "staff": True}, {}, False),
+    ("claim.level == 1.5 or claim.level == null", {}, {}, True),
+    ("claim.level >= 2 and claim.level < 3", {"level": 2}, {}, True),
+    ("claim.level > path.level", {"level": 2}, {"path_params": {"level": "10"}}, False),
+    ("claim.level <= 1", {}, {}, False),
+])
+def test_policy_evaluation(source, claims, request_params, expected):
+    policy = Policy(source)
+    assert policy.allows(_verified(**claims), _Request(**request_params)) is expected
+
+
+@pytest.mark.parametrize("source", [
+    "", "claim.mfa and", "(claim.mfa", "claim.mfa)", "claim", "path.a.b",
+    "user.name == 'a'", "claim.a = 1", "'a' in", "and claim.mfa", "claim.a ~ 1",
+])
+def test_invalid_policy(source):
+    with pytest.raises(PolicySyntaxError):
+        Policy(source)
+
+
+def test_invalid_policy_fails_at_decoration():
+    with pytest.raises(PolicySyntaxError):
+        @authorize_required(policy="claim.mfa and")
+        async def endpoint():
+            return {}
+
+
+def test_decisions_are_cached_by_token_and_inputs():
+    calls = []
+    policy = Policy("claim.tenant == path.tenant_id")
+    evaluate = policy._evaluate
+
+    def counting(token, request):
+        calls.append(token.token)
+        return evaluate(token, request)
+
+    policy._evaluate = counting
+    token = _verified(tenant="a")
+
+    assert policy.allows(token, _Request({"tenant_id": "a"}))
+    assert policy.allows(token, _Request({"tenant_id": "a"}))
+    assert not policy.allows(token, _Request({"tenant_id": "b"}))
+    assert not policy.allows(token, _Request({"tenant_id": "b"}))
+    assert policy.allows(_verified(tenant="b"), _Request({"tenant_id": "b"}))
+    assert len(calls) == 3
+
+
+def test_decisions_are_cached_by_scopes():
+    policy = compile_policy("'admin' in scopes")
+    claims = {"scopes": ["user:read"], "roles": ["admin"]}
+
+    # managers with other claim paths share the compiled policy.
+    assert not policy.allows(VerifiedToken("token-roles", claims, ["user:read"]), _Request())
+    assert policy.allows(VerifiedToken("token-roles", claims, ["user:read", "admin"]), _Request())
+
+
+def test_policies_are_compiled_once():
+    assert compile_policy(TENANT_POLICY) is compile_policy(TENANT_POLICY)
+
+
+def test_decorator_policy():
+    headers = _headers(scopes=["orders:write"], tenant="acme", mfa=True)
+    response = client.get("/tenants/acme/orders", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"tenant": "acme"}
+
+    # the cached decision depends on the path parameter.
+    response = client.get("/tenants/other/orders", headers=headers)
+    assert response.status_code == 401, response.text
+
+
+@pytest.mark.parametrize("claims", [
+    dict(scopes=["orders:read"], tenant="acme", mfa=True),
+    dict(scopes=["orders:write"], tenant="acme", mfa=False),
+    dict(scopes=["orders:write"], tenant="acme"),
+])
+def test_decorator_policy_denied(claims):
+    response = client.get("/tenants/acme/orders", headers=_headers(**claims))
+    assert response.status_code == 401, response.text
+
+
+def test_policy_does_not_replace_scopes():
+    response = client.get("/reports?region=eu", headers=_headers(scopes=["report:read"], regions=["eu"]))
+    assert response.status_code == 200, response.text
+
+    response = client.get("/reports?region=eu", headers=_headers(scopes=["admin"], regions=["eu"]))
+    assert response.status_code == 401, response.text
+
+    response = client.get("/reports?region=us", headers=_headers(scopes=["report:read"], regions=["eu"]))
+    assert response.status_code == 401, response.text
+
+
+def test_router_policy():
+    response = client.get("/items", headers=_headers(scopes=["item:read"]))
+    assert response.status_code == 200, response.text
+
+    response = client.get("/items", headers=_headers(scopes=["item:read"], suspended=True))
+    assert response.status_code == 401, response.text
+
+    response = client.get("/items", headers=_headers(scopes=["item:write"]))
+    assert response.status_code == 401, response.text
+
+
+def test_router_policy_without_scopes():
+    @policy_router.get("/levels")
+    async def levels():
+        return {}
+
+    checker = inspect.getclosurevars(levels).nonlocals["route"].checker
+    assert checker.scopes.scopes == []
+    assert checker.policy is compile_policy("claim.level >= 1 or claim.staff")
+
+    levels_app = FastAPI()
+    levels_app.include_router(policy_router)
+    levels_client = TestClient(levels_app)
+    response = levels_client.get("/levels", headers=_headers(level=2))
+    assert response.status_code == 200, response.text
+    response = levels_client.get("/levels", headers=_headers(staff=True))
+    assert response.status_code == 200, response.text
+    response = levels_client.get("/levels", headers=_headers(level=0, scopes=["item:read"]))
+    assert response.status_code == 401, response.text
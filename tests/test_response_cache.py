@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+
+from . import authorize_required
+from . import authorize_router
+from . import PermissionManager
+from . import LoginManager
+from . import ResponseCache
+from lollol._authorize import _pemission_local
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+
+
+def _headers(*scopes):
+    token = manager.create_access_token(data=dict(sub="uram24@42maru.com", scopes=list(scopes)))
+    return {"Authorization": f"Bearer {token}"}
+
+
+clock = Clock()
+cache = ResponseCache(maxsize=2, ttl=10, timer=clock)
+calls = []
+
+app = FastAPI()
+router = authorize_router(APIRouter(), SecurityScopes(["item:read"]), cache=cache)
+
+
+@app.get("/reports/{report_id}")
+@authorize_required(cache=cache)
+async def report(report_id: int, limit: int = 10, scopes=SecurityScopes(["report:read"])):
+    calls.append((report_id, limit))
+    return {"report_id": report_id, "limit": limit}
+
+
+@router.get("/items")
+def items(request: Request):
+    calls.append("items")
+    return ["item"]
+
+
+@router.post("/items")
+def create_item():
+    calls.append("create")
+    return {}
+
+
+@router.get("/text")
+def text():
+    calls.append("text")
+    return PlainTextResponse("text")
+
+
+app.include_router(router)
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def permission_manager():
+    permission_manager = PermissionManager(manager)
+    yield permission_manager
+    _pemission_local.pop()
+    cache.clear()
+    calls.clear()
+
+
+def test_hit_does_not_call_endpoint():
+    headers = _headers("report:read")
+    for _ in range(3):
+        response = client.get("/reports/1?limit=5", headers=headers)
+        assert response.status_code == 200, response.text
+        assert response.json() == {"report_id": 1, "limit": 5}
+    assert calls == [(1, 5)]
+    assert cache.stats.hits == 2
+
+
+def test_key_of_parameters_and_scopes():
+    headers = _headers("report:read")
+    client.get("/reports/1?limit=5", headers=headers)
+    client.get("/reports/2?limit=5", headers=headers)
+    client.get("/reports/1?limit=6", headers=headers)
+    # another scope set has its own entry, the order of scopes does not matter.
+    client.get("/reports/1?limit=5", headers=_headers("report:read", "admin"))
+    client.get("/reports/1?limit=5", headers=_headers("admin", "report:read"))
+    assert calls == [(1, 5), (2, 5), (1, 6), (1, 5)]
+
+
+def test_hit_is_served_after_permission_check():
+    client.get("/reports/1", headers=_headers("report:read"))
+
+    assert client.get("/reports/1", headers=_headers("item:read")).status_code == 401
+    assert client.get("/reports/1", headers={"Authorization": "Bearer invalid"}).status_code == 401
+    assert calls == [(1, 10)]
+
+
+def test_router_caches_get_only():
+    headers = _headers("item:read")
+    for _ in range(2):
+        assert client.get("/items", headers=headers).json() == ["item"]
+        assert client.post("/items", headers=headers).status_code == 200
+        assert client.get("/text", headers=headers).text == "text"
+    assert calls == ["items", "create", "text", "create", "text"]
+
+
+def test_expiry_and_eviction():
+    headers = _headers("report:read")
+    client.get("/reports/1", headers=headers)
+    clock.now += 11
+    client.get("/reports/1", headers=headers)
+    assert calls == [(1, 10), (1, 10)]
+
+    client.get("/reports/2", headers=headers)
+    client.get("/reports/3", headers=headers)
+    client.get("/reports/1", headers=headers)
+    assert len(cache) == 2
+    assert calls[-1] == (1, 10)
+
+
+def test_concurrent_misses_are_coalesced():
+    responses = ResponseCache()
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": 1}
+
+    async def run():
+        return await asyncio.gather(*(responses.get_or_load("key", load) for _ in range(5)))
+
+    results = asyncio.get_event_loop().run_until_complete(run())
+    assert results == [{"id": 1}] * 5
+    assert loads == [1]
+    assert responses.stats.coalesced == 4
@@ -0,0 +1,180 @@
+import os
+import stat
+from datetime import timedelta
+
+import pytest
+
+from fastapi import FastAPI, Request
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+
+from . import authorize_required
+from . import get_verified_token
+from . import PermissionManager
+from . import LoginManager
+from . import SessionStore
+from lollol._authorize import _pemission_local
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def store(clock):
+    return SessionStore(maxsize=3, ttl=10, timer=clock)
+
+
+def test_session_lookup(store):
+    session_id = store.create("uram24@42maru.com", ["user:read"])
+
+    session = store.get(session_id)
+    assert session.subject == "uram24@42maru.com"
+    assert store.scopes(session.mask) == {"user:read"}
+    assert session_id in store
+    assert store.get("unknown") is None
+    assert len(session_id) >= 22
+
+
+def test_sliding_expiry(store, clock):
+    session_id = store.create("sunny", ttl=5)
+
+    clock.now += 4
+    assert store.get(session_id).expires == clock.now + 5
+    clock.now += 4
+    assert store.get(session_id) is not None
+    clock.now += 6
+    assert store.get(session_id) is None
+    assert len(store) == 0
+
+
+def test_fixed_expiry(clock):
+    store = SessionStore(ttl=10, sliding=False, timer=clock)
+    session_id = store.create("sunny")
+
+    clock.now += 9
+    assert store.get(session_id) is not None
+    clock.now += 2
+    assert session_id not in store
+
+
+def test_eviction_and_revoke(clock):
+    store = SessionStore(maxsize=3, ttl=10, timer=clock, stripes=1)
+    first, second, third = (store.create(n) for n in ("a", "b", "c"))
+    store.get(first)
+    store.create("d")
+
+    assert first in store
+    assert second not in store
+    assert store.revoke(third)
+    assert not store.revoke(third)
+
+
+def test_scope_bits(store):
+    store.create("a", ["user:read", "user:write"])
+    store.create("b", ["user:delete"])
+
+    assert store.mask(["user:read"]) == 1
+    assert store.mask(["user:write", "user:delete"]) == 6
+    assert store.mask(["unknown"]) == 0
+    assert store.scopes(5) == {"user:read", "user:delete"}
+
+
+def test_snapshot(tmp_path, clock):
+    path = str(tmp_path / "sessions.json")
+    store = SessionStore(ttl=10, timer=clock)
+    live = store.create("a", ["user:read", "user:write"])
+    expired = store.create("b", ["user:read"], ttl=1)
+    clock.now += 2
+
+    assert store.save(path) == 1
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    # the scopes have other bits in the restored store.
+    restored = SessionStore(ttl=10, timer=clock)
+    restored.create("c", ["user:write"])
+    clock.now += 5
+    assert restored.load(path) == 1
+
+    session = restored.get(live)
+    assert session.subject == "a"
+    assert restored.scopes(session.mask) == {"user:read", "user:write"}
+    assert expired not in restored
+
+    clock.now += 20
+    assert restored.load(path) == 0
+
+
+def test_create_session_token_without_store():
+    with pytest.raises(ValueError):
+        LoginManager("test_secret", "/auth").create_session_token("sunny")
+
+
+manager = LoginManager("test_secret", '/auth', use_header=True, session_store=SessionStore())
+app = FastAPI()
+client = TestClient(app)
+
+
+@app.get("/foo")
+@authorize_required
+async def foo(request: Request, scopes=SecurityScopes(["user:read"])):
+    token = get_verified_token(request)
+    return {"sub": token.subject, "scopes": sorted(token.scopes)}
+
+
+@pytest.fixture
+def permission_manager():
+    permission_manager = PermissionManager(manager)
+    yield permission_manager
+    _pemission_local.pop()
+
+
+def test_session_token(permission_manager):
+    token = manager.create_session_token("uram24@42maru.com", ["user:read", "user:delete"])
+
+    response = client.get("/foo", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"sub": "uram24@42maru.com", "scopes": ["user:delete", "user:read"]}
+
+
+def test_session_token_slides_by_its_expires(clock):
+    login_manager = LoginManager("test_secret", '/auth', session_store=SessionStore(ttl=900, timer=clock))
+    token = login_manager.create_session_token("alice", ["a"], expires=timedelta(seconds=60))
+
+    clock.now += 30
+    assert login_manager.session_store.get(token).expires == clock.now + 60
+    clock.now += 61
+    assert login_manager.session_store.get(token) is None
+
+
+def test_session_token_denied(permission_manager):
+    token = manager.create_session_token("uram24@42maru.com", ["user:delete"])
+    response = client.get("/foo", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401, response.text
+
+    token = manager.create_session_token("uram24@42maru.com", ["user:read"], timedelta(seconds=-1))
+    response = client.get("/foo", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401, response.text
+
+    token = manager.create_session_token("uram24@42maru.com", ["user:read"])
+    manager.session_store.revoke(token)
+    response = client.get("/foo", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401, response.text
+
+
+def test_access_token_with_session_store(permission_manager):
+    token = manager.create_access_token(data=dict(sub="uram24@42maru.com", scopes=["user:read"]))
+
+    response = client.get("/foo", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert permission_manager.verify(token, SecurityScopes(["user:read"])).subject == "uram24@42maru.com"
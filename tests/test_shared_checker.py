@@ -0,0 +1,46 @@
+import inspect
+
+import pytest
+
+from fastapi import APIRouter
+from fastapi.security import SecurityScopes
+
+from . import authorize_required
+from . import authorize_router
+from lollol._utils import _get_checker
+
+
+def _checker_of(endpoint):
+    return inspect.getclosurevars(endpoint).nonlocals["route"].checker
+
+
+def test_routes_with_same_scopes_share_checker():
+    router = authorize_router(APIRouter(), SecurityScopes(["user:read"]))
+
+    @router.get("/foo")
+    async def foo():
+        return {}
+
+    @router.get("/bar")
+    async def bar():
+        return {}
+
+    @authorize_required
+    async def hug(scopes=SecurityScopes(["user:read"])):
+        return {}
+
+    @authorize_required
+    async def lol(scopes=SecurityScopes(["user:write"])):
+        return {}
+
+    assert _checker_of(foo) is _checker_of(bar) is _checker_of(hug)
+    assert _checker_of(lol) is not _checker_of(foo)
+    assert inspect.signature(foo).parameters["scopes"] is _checker_of(foo).parameter
+
+
+def test_checker_is_immutable():
+    checker = _get_checker(SecurityScopes(["user:read"]))
+
+    assert checker is _get_checker(SecurityScopes(["user:read"]))
+    with pytest.raises(AttributeError):
+        checker.scopes = SecurityScopes(["user:write"])
@@ -0,0 +1,66 @@
+import asyncio
+import time
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from lollol._authorize import _pemission_local
+
+
+required_scopes = SecurityScopes(["user:read"])
+manager = LoginManager("test_secret", '/auth', use_header=True)
+manager.app_name = "test"
+access_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+
+
+@pytest.fixture
+def counted_manager():
+    login_manager = LoginManager("test_secret", '/auth', use_header=True)
+    decodes = []
+    get_payload = login_manager._get_payload
+
+    def counted(token):
+        decodes.append(token)
+        # widen the window in which the burst overlaps the decoding.
+        time.sleep(0.05)
+        return get_payload(token)
+
+    login_manager._get_payload = counted
+    with ThreadPoolExecutor(4) as executor:
+        pm = PermissionManager(login_manager, executor=executor)
+        yield pm, decodes
+    _pemission_local.pop()
+
+
+def test_burst_of_same_token_is_decoded_once(counted_manager):
+    pm, decodes = counted_manager
+
+    async def burst():
+        return await asyncio.gather(
+            *(pm.verify_async(access_token, required_scopes) for _ in range(30))
+        )
+
+    results = asyncio.get_event_loop().run_until_complete(burst())
+
+    assert len(decodes) == 1
+    assert all(result.subject == "uram24@42maru.com" for result in results)
+
+
+def test_scopes_are_checked_per_request(counted_manager):
+    pm, decodes = counted_manager
+
+    async def burst():
+        return await asyncio.gather(
+            pm.verify_async(access_token, required_scopes),
+            pm.verify_async(access_token, SecurityScopes(["user:write"])),
+        )
+
+    allowed, denied = asyncio.get_event_loop().run_until_complete(burst())
+
+    assert len(decodes) == 1
+    assert allowed is not None and denied is None
@@ -0,0 +1,117 @@
+import asyncio
+import time
+import threading
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from . import authorize_required
+from . import PermissionManager
+from . import LoginManager
+from . import set_threadpool_size
+from lollol import _utils
+
+
+required_scopes = ["user:read"]
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+manager.app_name = "test"
+
+access_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+
+PermissionManager(manager)
+
+app = FastAPI()
+client = TestClient(app)
+
+
+@app.get("/foo")
+@authorize_required
+def foo(scopes=SecurityScopes(required_scopes)):
+    return {"thread": threading.current_thread().name}
+
+
+@authorize_required
+def blocking(scopes=SecurityScopes(required_scopes)):
+    time.sleep(0.2)
+    return threading.current_thread().name
+
+
+def make_request():
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {access_token}".encode())],
+    })
+
+
+def call_blocking():
+    # FastAPI passes every parameter of the rewritten signature.
+    return blocking(request=make_request(), scopes=SecurityScopes(required_scopes))
+
+
+@pytest.fixture
+def threadpool_size():
+    yield set_threadpool_size
+    set_threadpool_size(None)
+
+
+def test_sync_endpoint():
+    response = client.get("/foo", headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["thread"] != threading.main_thread().name
+
+
+def test_event_loop_stays_responsive():
+    ticks = []
+
+    async def ticker():
+        for _ in range(10):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        return await asyncio.gather(call_blocking(), ticker())
+
+    start = time.monotonic()
+    asyncio.get_event_loop().run_until_complete(main())
+
+    # the ticker ran while the endpoint was blocking.
+    assert len(ticks) == 10
+    assert ticks[-1] - start < 0.2
+
+
+def test_configured_threadpool_size(threadpool_size):
+    threadpool_size(1)
+
+    async def main():
+        return await asyncio.gather(
+            call_blocking(), call_blocking()
+        )
+
+    start = time.monotonic()
+    names = asyncio.get_event_loop().run_until_complete(main())
+
+    assert time.monotonic() - start >= 0.4
+    assert all(name.startswith("lollol") for name in names)
+
+
+def test_resize_while_submitting(threadpool_size):
+    class Replaced(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            # another thread resizes the pool after it was read.
+            threadpool_size(1)
+            return super().submit(*args, **kwargs)
+
+    _utils._endpoint_executor = Replaced(1, thread_name_prefix="replaced")
+    name = asyncio.get_event_loop().run_until_complete(call_blocking())
+    assert name.startswith("lollol")
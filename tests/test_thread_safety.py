@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from . import SessionStore
+from . import TokenCache
+from lollol._authorize import _pemission_local
+from lollol._authorize import lookup_permission_obj
+from lollol._cache import StripedTTLCache
+
+
+THREADS = 8
+required_scopes = SecurityScopes(["user:read"])
+
+current = LoginManager("test_secret", '/auth', use_header=True)
+rotated = LoginManager("rotated_secret", '/auth', use_header=True)
+current_token = current.create_access_token(data=dict(sub="current", scopes=["user:read"]))
+rotated_token = rotated.create_access_token(data=dict(sub="rotated", scopes=["user:read"]))
+
+
+def run_threads(target, count=THREADS):
+    errors = []
+
+    def run(n):
+        try:
+            target(n)
+        except Exception as e:                                     # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_concurrent_registration():
+    manager = PermissionManager(current)
+    size = len(_pemission_local._local)
+
+    def register(n):
+        for _ in range(200):
+            PermissionManager(current)
+            assert lookup_permission_obj() is not None
+            _pemission_local.pop()
+
+    run_threads(register)
+    assert len(_pemission_local._local) == size
+    assert lookup_permission_obj() is manager
+    _pemission_local.pop()
+
+
+@pytest.mark.parametrize("token_cache", [None, TokenCache(1000)])
+def test_secret_rotation_under_load(token_cache):
+    login_manager = LoginManager("test_secret", '/auth', use_header=True)
+    manager = PermissionManager(login_manager, token_cache=token_cache)
+    stop = threading.Event()
+
+    def verify(n):
+        if n == 0:
+            for i in range(200):
+                manager.set_secret_key("rotated_secret" if i % 2 else "test_secret")
+            manager.set_secret_key("test_secret")
+            stop.set()
+            return
+        while not stop.is_set():
+            for token in (current_token, rotated_token):
+                verified = manager.verify(token, required_scopes)
+                assert verified is None or verified.subject in ("current", "rotated")
+
+    try:
+        run_threads(verify)
+        # no token verified with the rotated secret is in the current cache.
+        assert manager.has_permission(current_token, required_scopes)
+        assert not manager.has_permission(rotated_token, required_scopes)
+    finally:
+        _pemission_local.pop()
+
+
+def test_striped_cache():
+    cache = StripedTTLCache(256, stripes=8)
+
+    def use(n):
+        for i in range(2000):
+            key = (n, i % 100)
+            cache.set(key, i)
+            value = cache.get(key)
+            assert value is None or value % 100 == i % 100
+            if i % 7 == 0:
+                cache.pop(key)
+            list(cache.items())
+
+    run_threads(use)
+    assert len(cache) <= 256
+
+
+def test_session_scopes_get_one_bit():
+    store = SessionStore()
+    scopes = ["scope:%d" % n for n in range(64)]
+
+    def create(n):
+        for scope in scopes[n::2] + scopes:
+            store.create("sunny", [scope])
+
+    run_threads(create)
+    assert sorted(store.mask([scope]) for scope in scopes) == [1 << n for n in range(64)]
+
+
+def test_verify_from_thread_pool():
+    manager = PermissionManager(current, token_cache=TokenCache(100))
+    try:
+        with ThreadPoolExecutor(THREADS) as executor:
+            results = list(executor.map(
+                lambda _: manager.has_permission(current_token, required_scopes), range(500)
+            ))
+        assert all(results)
+        assert len(manager.token_cache) == 1
+    finally:
+        _pemission_local.pop()
+
+
+def test_mask_of_scope_added_concurrently():
+    store = SessionStore()
+    store.create("sunny", ["user:read"])
+    added = []
+
+    class Bits(dict):
+        def get(self, scope, default=None):
+            bit = super().get(scope, default)
+            # the scope is added after its bit was read for the mask.
+            if scope == "user:write" and not added:
+                added.append(threading.Thread(target=store._add_scope, args=(scope,)))
+                added[0].start()
+                added[0].join(0.1)
+            return bit
+
+    store._bits = Bits(store._bits)
+    store.mask(["user:write"])
+    added[0].join()
+    assert store.mask(["user:write"]) == 1 << store._bits["user:write"]
@@ -0,0 +1,153 @@
+import os
+import stat
+import time
+from datetime import timedelta
+
+import pytest
+
+from fastapi.security import SecurityScopes
+
+from . import PermissionManager
+from . import LoginManager
+from . import TokenCache
+from lollol._authorize import _pemission_local
+
+
+required_scopes = SecurityScopes(["user:read"])
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+access_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+
+
+def counting(permission_manager, monkeypatch):
+    calls = []
+    decode = permission_manager._decode
+
+    def _decode(token, extra_secret_key=None):
+        calls.append(token)
+        return decode(token, extra_secret_key)
+
+    monkeypatch.setattr(permission_manager, "_decode", _decode)
+    return calls
+
+
+@pytest.fixture
+def permission_managers():
+    created = []
+
+    def create(login_manager=manager, **kwargs):
+        created.append(PermissionManager(login_manager, token_cache=TokenCache(**kwargs)))
+        return created[-1]
+
+    yield create
+    for _ in created:
+        _pemission_local.pop()
+
+
+def test_token_is_decoded_once(permission_managers, monkeypatch):
+    permission_manager = permission_managers()
+    calls = counting(permission_manager, monkeypatch)
+
+    for _ in range(3):
+        assert permission_manager.has_permission(access_token, required_scopes)
+    assert not permission_manager.has_permission(access_token, SecurityScopes(["user:write"]))
+    assert not permission_manager.has_permission("invalid", required_scopes)
+    assert not permission_manager.has_permission("invalid", required_scopes)
+    assert calls == [access_token, "invalid", "invalid"]
+
+
+def test_entry_expires_with_token():
+    now = [1000.0]
+    cache = TokenCache(max_ttl=60, timer=lambda: now[0])
+    cache.set(b"short", {"exp": 1010})
+    cache.set(b"long", {"exp": 5000}, ["user:read"])
+    cache.set(b"expired", {"exp": 999})
+    cache.set(b"invalid", None)
+
+    assert len(cache) == 2
+    now[0] += 11
+    assert cache.get(b"short") is None
+    assert cache.get(b"long") == ({"exp": 5000}, ["user:read"])
+    now[0] += 50
+    assert cache.get(b"long") is None
+
+
+def test_set_secret_key_clears_cache(permission_managers):
+    login_manager = LoginManager("test_secret", '/auth')
+    permission_manager = permission_managers(login_manager)
+
+    assert permission_manager.has_permission(access_token, required_scopes)
+    permission_manager.set_secret_key("other_secret")
+    assert not permission_manager.has_permission(access_token, required_scopes)
+
+
+def test_snapshot(tmp_path, permission_managers, monkeypatch):
+    path = str(tmp_path / "tokens.cache")
+    short_token = manager.create_access_token(data=dict(sub="sunny", scopes=["user:read"]),
+                                              expires=timedelta(seconds=1))
+    before = permission_managers()
+    assert before.has_permission(access_token, required_scopes)
+    assert before.has_permission(short_token, required_scopes)
+    assert before.save_token_cache(path) == 2
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    time.sleep(1.1)
+    after = permission_managers()
+    calls = counting(after, monkeypatch)
+    assert after.load_token_cache(path) == 1
+    verified = after.verify(access_token, required_scopes)
+    assert verified.subject == "uram24@42maru.com"
+    assert calls == []
+
+
+def test_snapshot_of_another_secret(tmp_path, permission_managers):
+    path = str(tmp_path / "tokens.cache")
+    before = permission_managers()
+    before.has_permission(access_token, required_scopes)
+    before.save_token_cache(path)
+
+    other = permission_managers(LoginManager("other_secret", '/auth'))
+    assert other.load_token_cache(path) == 0
+    assert not other.has_permission(access_token, required_scopes)
+
+
+def test_corrupted_snapshot(tmp_path, permission_managers):
+    path = str(tmp_path / "tokens.cache")
+    permission_manager = permission_managers()
+    assert permission_manager.load_token_cache(path) == 0
+
+    permission_manager.has_permission(access_token, required_scopes)
+    permission_manager.save_token_cache(path)
+    with open(path, "r+b") as f:
+        data = bytearray(f.read())
+        data[-40] ^= 1
+        f.seek(0)
+        f.write(data)
+
+    with pytest.raises(ValueError):
+        permission_managers().load_token_cache(path)
+
+    with open(path, "wb") as f:
+        f.write(b"not a snapshot")
+    with pytest.raises(ValueError):
+        permission_managers().load_token_cache(path)
+
+
+def test_without_token_cache(tmp_path):
+    permission_manager = PermissionManager(manager)
+    try:
+        with pytest.raises(ValueError):
+            permission_manager.save_token_cache(str(tmp_path / "tokens.cache"))
+    finally:
+        _pemission_local.pop()
+
+
+def test_cached_claims_are_read_only(permission_managers):
+    permission_manager = permission_managers()
+    verified = permission_manager.verify(access_token, required_scopes)
+
+    with pytest.raises(TypeError):
+        verified.claims["sub"] = "admin"
+    assert permission_manager.verify(access_token, required_scopes).claims["sub"] == "uram24@42maru.com"
@@ -0,0 +1,103 @@
+import asyncio
+
+from . import LoginManager
+from . import UserCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def async_test(coro):
+    def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coro(*args, **kwargs))
+    return wrapper
+
+
+def make_manager(cache):
+    manager = LoginManager("test_secret", '/auth', use_header=True, user_cache=cache)
+    calls = []
+
+    @manager.user_loader()
+    async def load_user(user_id):
+        calls.append(user_id)
+        await asyncio.sleep(0.01)
+        if user_id == "missing":
+            return None
+        return {"id": user_id}
+
+    return manager, calls
+
+
+@async_test
+async def test_concurrent_loads_are_coalesced():
+    manager, calls = make_manager(UserCache())
+    users = await asyncio.gather(
+        *(manager._load_user("service") for _ in range(50))
+    )
+
+    assert calls == ["service"]
+    assert all(user == {"id": "service"} for user in users)
+    assert manager.user_cache.stats.coalesced == 49
+
+
+@async_test
+async def test_cached_user_and_invalidate():
+    manager, calls = make_manager(UserCache())
+    await manager._load_user("sunny")
+    await manager._load_user("sunny")
+    assert calls == ["sunny"]
+
+    manager.user_cache.invalidate("sunny")
+    await manager._load_user("sunny")
+
+    stats = manager.user_cache.stats
+    assert calls == ["sunny", "sunny"]
+    assert (stats.hits, stats.misses) == (1, 2)
+
+
+@async_test
+async def test_ttl_and_maxsize():
+    clock = Clock()
+    manager, calls = make_manager(UserCache(maxsize=2, ttl=10, timer=clock))
+    await manager._load_user("a")
+    clock.now = 11
+    await manager._load_user("a")
+    assert calls == ["a", "a"]
+
+    await manager._load_user("b")
+    await manager._load_user("c")
+    assert manager.user_cache.stats.size == 2
+
+
+@async_test
+async def test_none_user_is_not_cached():
+    manager, calls = make_manager(UserCache())
+    assert await manager._load_user("missing") is None
+    assert await manager._load_user("missing") is None
+    assert calls == ["missing", "missing"]
+
+
+@async_test
+async def test_invalidate_during_load():
+    manager, calls = make_manager(UserCache())
+    stale = asyncio.ensure_future(manager._load_user("sunny"))
+    await asyncio.sleep(0.001)
+    manager.user_cache.invalidate("sunny")
+    assert await stale == {"id": "sunny"}
+    assert manager.user_cache.stats.size == 0
+
+    stale = asyncio.ensure_future(manager._load_user("sunny"))
+    await asyncio.sleep(0.001)
+    manager.user_cache.invalidate("sunny")
+    # a load after the invalidation does not share the stale load.
+    assert await manager._load_user("sunny") == {"id": "sunny"}
+    await stale
+    await manager._load_user("sunny")
+    assert calls == ["sunny", "sunny", "sunny"]
+    assert manager.user_cache.stats.size == 1
@@ -0,0 +1,74 @@
+import asyncio
+import typing as t
+
+from pydantic import BaseModel
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from fastapi.security import SecurityScopes
+
+from . import authorize_required
+from . import PermissionManager
+from . import LoginManager
+from . import get_verified_token
+from . import VerifiedToken
+
+
+required_scopes = ["user:read"]
+
+manager = LoginManager("test_secret", '/auth', use_header=True)
+manager.app_name = "test"
+
+access_token = manager.create_access_token(
+    data=dict(sub="uram24@42maru.com", scopes=["user:read", "user:delete"])
+)
+
+users = {"uram24@42maru.com": {"name": "sunny"}}
+
+
+@manager.user_loader()
+def load_user(user_id):
+    return users.get(user_id)
+
+
+PermissionManager(manager)
+
+app = FastAPI()
+client = TestClient(app)
+
+
+class Items(BaseModel):
+    items: t.Dict[str, int]
+
+
+@app.post("/foo")
+@authorize_required
+async def foo(items: Items, request: Request, scopes=SecurityScopes(required_scopes)):
+    token = get_verified_token(request)
+    return {"sub": token.subject, "scopes": sorted(token.scopes)}
+
+
+def test_verified_token_in_request_state():
+    response = client.post("/foo",
+                           json={"items": {"foo": 1}},
+                           headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"sub": "uram24@42maru.com",
+                               "scopes": ["user:delete", "user:read"]}
+
+
+def test_verify_returns_slotted_token():
+    pm = PermissionManager(manager)
+    token = pm.verify(access_token, SecurityScopes(required_scopes))
+
+    assert isinstance(token, VerifiedToken)
+    assert not hasattr(token, "__dict__")
+    assert token.claims["sub"] == "uram24@42maru.com"
+    assert pm.verify(access_token, SecurityScopes(["user:write"])) is None
+
+
+def test_load_user_from_verified_token():
+    pm = PermissionManager(manager)
+    token = pm.verify(access_token, SecurityScopes(required_scopes))
+    user = asyncio.get_event_loop().run_until_complete(pm.load_user(token))
+
+    assert user == {"name": "sunny"}
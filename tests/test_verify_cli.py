@@ -0,0 +1,103 @@
+import io
+import json
+import subprocess
+import sys
+
+import jwt
+import pytest
+
+from datetime import timedelta
+
+from . import LoginManager
+from lollol import verify
+
+
+current = LoginManager("current_secret", '/auth')
+previous = LoginManager("previous_secret", '/auth')
+attacker = LoginManager("attacker_secret", '/auth')
+
+lines = [
+    current.create_access_token(data=dict(sub="a", scopes=["user:read"])),
+    "127.0.0.1 GET /users Authorization: Bearer "
+    + previous.create_access_token(data=dict(sub="b", scopes=["user:read"])),
+    attacker.create_access_token(data=dict(sub="c", scopes=["user:read"])),
+    current.create_access_token(data=dict(sub="d"), expires=timedelta(seconds=-60)),
+    current.create_access_token(data=dict(sub="e", scopes=["user:read", "admin"])),
+    "aaa.bbb.ccc",
+    "no token here",
+    jwt.encode({"sub": "f"}, "current_secret", algorithm="HS512"),
+]
+expected = [
+    ("valid", 0), ("valid", 1), ("forged", None), ("expired", 0),
+    ("over_scoped", 0), ("malformed", None), ("no_token", None), ("forged", None),
+]
+
+
+@pytest.fixture
+def token_file(tmp_path):
+    path = tmp_path / "access.log"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def run_main(monkeypatch, *argv):
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", stdout)
+    assert verify.main(list(argv)) == 0
+    return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+
+@pytest.mark.parametrize("processes", ["1", "2"])
+def test_verdicts(monkeypatch, token_file, processes):
+    verdicts = run_main(
+        monkeypatch, token_file, "--secret", "current_secret", "--secret", "previous_secret",
+        "--allowed-scopes", "user:read", "--processes", processes, "--chunksize", "3"
+    )
+
+    assert [(v["verdict"], v.get("secret")) for v in verdicts] == expected
+    assert [v["line"] for v in verdicts] == list(range(1, len(lines) + 1))
+    assert verdicts[0]["sub"] == "a"
+    assert verdicts[4]["extra_scopes"] == ["admin"]
+    assert all(lines[0] not in json.dumps(v) for v in verdicts)
+
+
+def test_allowed_scopes_before_files(monkeypatch, token_file):
+    verdicts = run_main(
+        monkeypatch, "--secret", "current_secret", "--allowed-scopes", "user:read,user:write",
+        "--allowed-scopes", "user:delete", token_file, "--processes", "1"
+    )
+
+    assert len(verdicts) == len(lines)
+    assert verdicts[0]["verdict"] == "valid"
+    assert verdicts[4]["extra_scopes"] == ["admin"]
+
+
+def test_stdin(monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO(lines[0] + "\n"))
+    verdicts = run_main(monkeypatch, "--secret", "current_secret", "--processes", "1")
+    assert [v["verdict"] for v in verdicts] == ["valid"]
+
+
+def test_module_entry_point(token_file):
+    result = subprocess.run(
+        [sys.executable, "-m", "lollol.verify", token_file, "--secret", "current_secret"],
+        check=True, capture_output=True, text=True
+    )
+    assert len(result.stdout.splitlines()) == len(lines)
+
+
+@pytest.mark.parametrize("claims, verdict, scopes", [
+    ({"scopes": None}, "valid", []),
+    ({"scopes": 3}, "valid", []),
+    ({"scopes": "user:read admin"}, "over_scoped", ["admin", "user:read"]),
+    ({"scopes": ["user:read"], "aud": "api"}, "invalid_claims", None),
+    ({"scopes": ["user:read"], "nbf": 4102444800}, "invalid_claims", None),
+    ({"scopes": ["user:read"], "iat": "yesterday"}, "invalid_claims", None),
+])
+def test_claims_of_signed_tokens(claims, verdict, scopes):
+    auditor = verify.TokenAuditor(["current_secret"], allowed_scopes=["user:read"])
+    result = auditor.verdict(1, jwt.encode(claims, "current_secret", algorithm="HS256"))
+
+    assert result["verdict"] == verdict
+    assert result["secret"] == 0
+    assert result.get("scopes") == scopes